@@ -1,59 +1,125 @@
-import sqlite3
-import streamlit as st
+import threading
+from app.db import SETTINGS_DB, get_connection, transaction
+
+# Settings stored in the settings table, with their defaults
+DEFAULTS = {
+    "DIFY_API_URL": "http://localhost:8000/v1",
+    "DIFY_API_KEY": "",
+    "SELECTED_CHAT": "",
+    "CONVERSATION_ID": "",
+    "ASYNC_WRITES": "False",
+    "RESPONSE_CACHE": "False",
+}
+
+
+class SettingsStore:
+    """
+    Process-wide cache of the settings table, shared by every AppSettings.
+
+    The table is read once, with a single SELECT, the first time settings are needed.
+    Every save bumps the revision, so sessions holding an AppSettings can tell that
+    settings were changed by another session.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.revision = 0
+        self._values = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        conn = get_connection(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        self._values = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+
+    def snapshot(self) -> tuple:
+        """Return (values, revision): a copy of all stored settings and their revision."""
+        with self._lock:
+            if self._values is None:
+                self._load()
+            return dict(self._values), self.revision
+
+    def write(self, changes: dict) -> int:
+        """Save the given settings in one transaction and return the new revision."""
+        with self._lock:
+            if self._values is None:
+                self._load()
+            with transaction(self.db_path) as conn:
+                conn.executemany("""
+                    INSERT INTO settings (key, value)
+                    VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """, changes.items())
+            self._values.update(changes)
+            self.revision += 1
+            return self.revision
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str = SETTINGS_DB) -> SettingsStore:
+    """Return the process-wide SettingsStore of db_path."""
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = SettingsStore(db_path)
+        return _stores[db_path]
 
 
 class AppSettings:
-    def __init__(self, db_path="app/data/settings.db"):
+    def __init__(self, db_path=SETTINGS_DB):
         self.db_path = db_path
-        self._create_table()
-
-
-        self.DIFY_API_URL = self.get_setting("DIFY_API_URL", "http://localhost:8000/v1")
-        self.DIFY_API_KEY = self.get_setting("DIFY_API_KEY", "")
-        self.SELECTED_CHAT = self.get_setting("SELECTED_CHAT", "")
-        self.CONVERSATION_ID = self.get_setting("CONVERSATION_ID", "")
-
-    def _create_table(self):
-        """Create settings table if it doesn't exist."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            conn.commit()
+        self._store = get_store(db_path)
+        self._load()
+
+    def _load(self):
+        """Copy the settings from the process-wide store; no database access once it is loaded."""
+        values, self._revision = self._store.snapshot()
+        self._saved = {}
+        for key, default in DEFAULTS.items():
+            value = values.get(key, default)
+            setattr(self, key, value)
+            self._saved[key] = value
+
+    def is_stale(self):
+        """Return whether another session saved settings since these were loaded."""
+        return self._store.revision != self._revision
+
+    def refresh(self):
+        """
+        Reload the settings if another session changed them. Unsaved changes are discarded.
+
+        Returns:
+            bool: Whether the settings were reloaded.
+        """
+        if not self.is_stale():
+            return False
+        self._load()
+        return True
 
     def get_setting(self, key, default=None):
-        """Retrieve a setting value from the database."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-            result = cursor.fetchone()
-            if result:
-                return result[0]  # Return the value
-            else:
-                return default
+        """Retrieve a setting value."""
+        values, _ = self._store.snapshot()
+        return values.get(key, default)
 
     def set_setting(self, key, value):
         """Save or update a setting value in the database."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO settings (key, value)
-                VALUES (?, ?)
-                ON CONFLICT(key) DO UPDATE SET value = excluded.value
-            """, (key, value))
-            conn.commit()
+        self._store.write({key: value})
 
     def save(self):
-        """Save all settings to the database."""
-
-        self.set_setting("DIFY_API_URL", self.DIFY_API_URL)
-        self.set_setting("DIFY_API_KEY", self.DIFY_API_KEY)
-        self.set_setting("SELECTED_CHAT", self.SELECTED_CHAT)
-        self.set_setting("CONVERSATION_ID", self.CONVERSATION_ID)
-
-
+        """Save the settings that changed since they were loaded, in one transaction."""
+        changes = {key: getattr(self, key) for key in DEFAULTS if getattr(self, key) != self._saved[key]}
+        if not changes:
+            return
 
+        stale = self.is_stale()
+        revision = self._store.write(changes)
+        self._saved.update(changes)
+        if not stale:
+            self._revision = revision
@@ -49,50 +49,94 @@ def setup_error_dialog(info: str):
     st.stop()
 
 
-# Function to simulate streaming data
-# Function to stream non-table content and display the table at once
+# Seconds between two re-renders of a streaming response
+STREAM_RENDER_INTERVAL = 0.05
+
+
+# Function to stream the AI response into the chat as it arrives
 def stream_ai_response(content):
     """
-    Simulate streaming of AI response by displaying content word by word with a delay.
+    Display an AI response while it arrives.
 
     Args:
-        content (str): The content to be streamed.
+        content (str | iterable): The whole response, or an iterable of text chunks such as
+            the dify.WorkflowStream returned by llm_chat_stream. If the iterable has a final
+            "response" once exhausted, that text is shown and returned.
 
     Returns:
         str: The fully streamed content.
     """
-    """Simulate streaming of AI response."""
     message_container = st.empty()  # Reserve space for the AI message
+    if isinstance(content, str):
+        content = [content]
+
     streamed_content = ""
-    for word in content.split(" "):  # Stream content word by word
-        streamed_content += word + " "
-        # Update the container with streamed content
-        message_container.markdown(
-            f'<div class="custom-ai-content">{streamed_content}</div>',
-            unsafe_allow_html=True,
-        )
-        time.sleep(0.02)  # Simulate a delay for each word
+    last_render = 0.0
+    for chunk in content:
+        streamed_content += chunk
+        # Re-render at most every STREAM_RENDER_INTERVAL seconds; chunks can be single tokens
+        if time.monotonic() - last_render >= STREAM_RENDER_INTERVAL:
+            message_container.markdown(
+                f'<div class="custom-ai-content">{streamed_content}</div>',
+                unsafe_allow_html=True,
+            )
+            last_render = time.monotonic()
+
+    streamed_content = getattr(content, "response", None) or streamed_content
+    message_container.markdown(
+        f'<div class="custom-ai-content">{streamed_content}</div>',
+        unsafe_allow_html=True,
+    )
     return streamed_content
 
 
+class WaitNotice:
+    """
+    Shows in the page how long a call has been waiting, from its first wait on: pass it
+    as the on_wait callback of e.g. AdmissionController.acquire, then clear() it. Updating
+    the page also lets Streamlit stop the script meanwhile if the user moves on.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        self._placeholder = None
+
+    def __call__(self, waited: float):
+        if self._placeholder is None:
+            self._placeholder = st.empty()
+        self._placeholder.info(f"{self.message} ({waited:.0f}s)")
+
+    def clear(self):
+        if self._placeholder is not None:
+            self._placeholder.empty()
+            self._placeholder = None
+
+
 # Print the response of the user
-def print_ai_response(ai_response, selected_chat, history, user_input_id):
+def print_ai_response(ai_response, selected_chat=None, history=None, user_input_id=None):
     """
-    Prints the AI's response in a chat message with an avatar and updates the session state.
+    Prints the AI's response in a chat message with an avatar and, if a history is given,
+    saves it for the user input.
 
     Args:
-        ai_response (str): The response generated by the AI.
+        ai_response (str | iterable): The response generated by the AI, or its text chunks
+            as they are generated (see stream_ai_response).
+        selected_chat (str): The chat session the response belongs to.
+        history (ChatHistory): Where to save the response. Pass None to save it yourself,
+            e.g. together with the rest of the turn in one ChatHistory.transaction().
+        user_input_id (int): The user input the response answers.
 
     Returns:
-        None
+        str: The streamed response.
     """
 
     # Placeholder for AI's streamed response
     with st.chat_message("ai", avatar="🔍"):
-        ai_streamed_response = stream_ai_response(f"{ai_response}")
-        # Add the complete streamed response to session state
-        history.add_ai_response(selected_chat, user_input_id, ai_streamed_response)
-        # Update the conversation history
+        ai_streamed_response = stream_ai_response(ai_response)
+        # Add the complete streamed response to the conversation history
+        if history is not None:
+            history.add_ai_response(selected_chat, user_input_id, ai_streamed_response)
+    return ai_streamed_response
 
 
 def render_latex(content: str):
@@ -135,9 +179,7 @@ def on_regenerate_response(user_input: str,
         
 
         with st.chat_message("ai", avatar="🔍"):
-            ai_streamed_response = stream_ai_response(
-                f"{new_ai_response}"
-            )
+            ai_streamed_response = stream_ai_response(new_ai_response)
 
         st.session_state["messages"] = [
             {
@@ -156,7 +198,7 @@ def on_regenerate_response(user_input: str,
             ai_streamed_response,
             version=max_version + 1,
         )
-        history.load_chat_into_session_state(selected_chat)
+        history.load_chat_into_session_state(selected_chat, keep_loaded=True)
         st.rerun()
 
 
@@ -214,9 +256,10 @@ def display_messages(
             
 
             user_input = message["user_input"]
-            user_input_id = history.get_user_input_id(selected_chat, user_input)
-            ai_responses = history.get_ai_responses(user_input_id)
-            max_version = len(ai_responses)
+            user_input_id = message["user_input_id"]
+            # Version count comes with the loaded conversation; the versions themselves
+            # are only fetched when the user navigates between them.
+            max_version = message["max_version"]
             col1, _ = st.columns([5, 4])
             current_version = message["version"]
 
@@ -272,6 +315,7 @@ def display_messages(
                     ):
                         if current_version > 1:
                             # Load the previous version
+                            ai_responses = history.get_ai_responses(user_input_id)
                             idx = current_version - 1
                             idx = (idx - 1) % max_version
                             messages[i]["content"] = ai_responses[idx][0]
@@ -293,6 +337,7 @@ def display_messages(
                     ):
                         # Load the next version (if available)
                         if current_version < max_version:
+                            ai_responses = history.get_ai_responses(user_input_id)
                             idx = current_version - 1
                             idx = (idx + 1) % max_version
                             logging.info(f"Next version index: {idx}")
@@ -309,8 +354,10 @@ def display_messages(
                             
                     
         elif message["role"] == "user":
-            # A unique key for the edit state of the message
-            edit_key = f"editing_{i}"
+            # A unique key for the edit state of the message; keyed by the input rather
+            # than the position, which shifts when earlier messages are loaded
+            user_input_id = message["user_input_id"]
+            edit_key = f"editing_{user_input_id}"
             message["idx"] = i
             logging.info(f"Message: {message}")
             logging.info(f"message_idx: {i}")
@@ -322,7 +369,7 @@ def display_messages(
                     "Edit your message",
                     message["content"],
                     max_chars=2000,
-                    key=f"edit_message_{i}",
+                    key=f"edit_message_{user_input_id}",
                 )
 
                 def on_edit_submit(ola_message = message):
@@ -359,7 +406,7 @@ def display_messages(
 
                         # Stream the new AI response
                         with st.chat_message("ai", avatar="🔍"):
-                            ai_streamed_response = stream_ai_response(f"{new_ai_response}")
+                            ai_streamed_response = stream_ai_response(new_ai_response)
 
                         # Update the conversation history
                         history.add_ai_response(
@@ -369,7 +416,7 @@ def display_messages(
                             version=max_version + 1,
                         )
 
-                        history.load_chat_into_session_state(selected_chat)
+                        history.load_chat_into_session_state(selected_chat, keep_loaded=True)
 
                     # Reset the editing state and rerun
                     st.session_state[edit_key] = False
@@ -382,9 +429,9 @@ def display_messages(
                 # Show buttons for submitting or canceling edits
                 col1, col2, _ = st.columns([1, 1, 6])
                 with col1:
-                    send = st.button("Send", key=f"send_{i}")
+                    send = st.button("Send", key=f"send_{user_input_id}")
                 with col2:
-                    st.button("Cancel", key=f"cancel_{i}", on_click=on_edit_cancel)
+                    st.button("Cancel", key=f"cancel_{user_input_id}", on_click=on_edit_cancel)
                 if send:
                     on_edit_submit()
 
@@ -392,7 +439,7 @@ def display_messages(
                 # Display the edit button
                 edit_msg, user = st.columns([0.3, 6])
                 with edit_msg:
-                    if st.button("📝", key=f"edit_msg_btn_{i}_{selected_chat}"):
+                    if st.button("📝", key=f"edit_msg_btn_{user_input_id}_{selected_chat}"):
                         st.session_state[edit_key] = True
                         st.session_state["ai_response_idx"] = i + 1
                         st.rerun()
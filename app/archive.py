@@ -0,0 +1,40 @@
+import argparse
+from app.db import CHAT_HISTORY_DB
+from app.history import ChatHistory, IMPORT_BATCH_SIZE
+
+# ================= Chat Archive Command Line =================
+# Export or import the whole chat history as a JSONL archive, e.g.
+#   python -m app.archive export backup.jsonl
+#   python -m app.archive import backup.jsonl --db app/data/chat_history.db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import the ResearchFlow chat history as JSONL.")
+    parser.add_argument("--db", default=CHAT_HISTORY_DB, help="Path of the chat history database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write every chat session to a JSONL archive.")
+    export_parser.add_argument("path", help="Archive file to write.")
+
+    import_parser = commands.add_parser("import", help="Add the chat sessions of a JSONL archive.")
+    import_parser.add_argument("path", help="Archive file to read.")
+    import_parser.add_argument(
+        "--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Records inserted per transaction."
+    )
+
+    args = parser.parse_args(argv)
+    history = ChatHistory(args.db)
+
+    if args.command == "export":
+        count = history.export_jsonl(args.path)
+        print(f"Exported {count} records to {args.path}")
+    else:
+        counts = history.import_jsonl(args.path, args.batch_size)
+        print(
+            f"Imported {counts['sessions']} sessions, {counts['user_inputs']} user inputs and "
+            f"{counts['ai_responses']} AI responses from {args.path} ({counts['skipped']} records skipped)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+
+class RevisionCache:
+    """
+    Bounded, thread-safe LRU cache whose entries are invalidated by revision.
+
+    Every cached value belongs to a scope (e.g. one chat session). Each scope has a
+    revision taken from a process-wide, monotonically increasing counter; entries are
+    stored under the revision that was current when loading started, so bumping a
+    scope's revision with invalidate() makes all of its entries unreachable. Stale
+    entries are never looked up again and age out through LRU eviction.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._revisions = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def revision(self, scope) -> int:
+        """Return the current revision of scope."""
+        with self._lock:
+            return self._revisions.get(scope, 0)
+
+    def get_or_load(self, scope, key, loader):
+        """
+        Return the cached value for key in scope, calling loader() to fill it on a miss.
+
+        The revision is read before loading, so a write that lands while loader() runs
+        makes the freshly stored value unreachable instead of serving it as current.
+        """
+        with self._lock:
+            entry_key = (scope, self._revisions.get(scope, 0), key)
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return self._entries[entry_key]
+            self.misses += 1
+
+        value = loader()
+
+        with self._lock:
+            self._entries[entry_key] = value
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *scopes):
+        """Bump the revision of every given scope."""
+        with self._lock:
+            for scope in scopes:
+                self._clock += 1
+                self._revisions[scope] = self._clock
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
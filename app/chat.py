@@ -6,7 +6,8 @@ from app.file_upload import upload_file
 import app.state_manager as state_manager  # Import state_manager for state management
 import app.app_utils as app_utils
 import app.markdown as markdown
-from app.dify import llm_chat
+from app.dify import llm_chat_stream, abandon_runs
+import app.conversation as conversation
 from app.app_settings import AppSettings  # Import AppSettings for app settings
 from streamlit_option_menu import option_menu
 import app.history as ht
@@ -76,27 +77,84 @@ st.write("Welcome to your personalized Research assistant!")
 
 st.markdown("""___""")
 
+# Queue chat history writes for a background writer thread if enabled in the settings
+ht.set_async_writes(settings.ASYNC_WRITES == "True")
 history = ht.ChatHistory()
 
 # Create a container for messages
 # Display chat messages
 def on_change(key):
+    abandon_runs()
     settings.SELECTED_CHAT = st.session_state[key]
     settings.save()
     history.load_chat_into_session_state(settings.SELECTED_CHAT)
     st.session_state["new_chat"] = False
     # state_manager.display_messages(settings.SELECTED_CHAT)
 
+def open_search_result(title):
+    abandon_runs()
+    settings.SELECTED_CHAT = title
+    settings.save()
+    history.load_chat_into_session_state(title)
+    st.session_state["new_chat"] = False
+    st.session_state["chat_search"] = ""
+
+def load_session_titles():
+    """
+    Return the session titles shown in the sidebar, most recently active first: the
+    first st.session_state["session_pages"] pages. Pages are served from the history
+    cache until a session is created, renamed, deleted or gets a new message.
+
+    Returns:
+        tuple: (titles, has_more) where has_more tells whether older sessions exist.
+    """
+    titles = []
+    cursor = None
+    for _ in range(st.session_state["session_pages"]):
+        sessions, cursor = history.fetch_chat_session_page(cursor=cursor)
+        titles.extend(session["title"] for session in sessions)
+        if cursor is None:
+            break
+    return titles, cursor is not None
+
+def show_more_sessions():
+    st.session_state["session_pages"] += 1
+
 # ================= sidebar Configuration =================
 with st.sidebar:
 
+    # ================= Chat Search =================
+    search_query = st.text_input(
+        "Search chats",
+        key="chat_search",
+        placeholder="🔎 Search chats",
+        label_visibility="collapsed",
+    )
+    if search_query:
+        search_results = history.search(search_query, limit=10)
+        with st.container(height=250, border=False):
+            if not search_results:
+                st.caption("No matching messages found.")
+            for j, result in enumerate(search_results):
+                st.button(
+                    result["title"],
+                    key=f"search_result_{j}",
+                    use_container_width=True,
+                    on_click=open_search_result,
+                    args=(result["title"],),
+                )
+                st.caption(result["snippet"])
+
     with st.container(height=500, border=False):
         chat = settings.SELECTED_CHAT
         # Chat interface
         
-        chat_history = history.fetch_chat_sessions()
-        logging.info(f"Chat History: {chat_history}")
-        
+        chat_history, more_sessions = load_session_titles()
+
+        # Keep a selected chat that is older than the loaded pages (e.g. opened from search)
+        if chat and chat not in chat_history and history.chat_session_exists(chat):
+            chat_history.append(chat)
+
         # load a different chat if the selected chat is deleted
         if chat not in chat_history and len(chat_history) > 0:
             chat = chat_history[0]
@@ -127,6 +185,14 @@ with st.sidebar:
             if not st.session_state["new_chat"] and not st.session_state["chat_loaded"]:
                 history.load_chat_into_session_state(settings.SELECTED_CHAT)
                 st.session_state["chat_loaded"] = True
+
+            if more_sessions:
+                st.button(
+                    "More chats",
+                    key="more_sessions_button",
+                    use_container_width=True,
+                    on_click=show_more_sessions,
+                )
                 
             
         else:
@@ -169,6 +235,7 @@ with st.sidebar:
                                 )
 
 if create_chat_button:
+    abandon_runs()
     st.session_state["new_chat"] = True
     
     st.rerun()
@@ -176,6 +243,8 @@ if create_chat_button:
 
 
 if delete_chat_button:
+    # Nobody will read the answers still being generated for this chat
+    abandon_runs()
     history.delete_chat_session(settings.SELECTED_CHAT)
     if len(chat_history) > 0:
         selected_chat = chat_history[0]
@@ -274,17 +343,13 @@ def send_message(u_input : str, selected_chat : str):
         None
     """
     
+    title_run = None
     if st.session_state["new_chat"]:
-        new_chat_input =f"Can you generate single chat tilte for this user input: '{u_input}' \n I only need one chat title"
-        user_input = app_utils.gen_user_input(selected_chat, new_chat_input, False)
-        selected_chat, _ = llm_chat(
-            user_input,  settings, []
-        )
-        
-        history.create_chat_session(selected_chat)
-        if selected_chat is not None:
-            settings.SELECTED_CHAT = selected_chat
-            settings.save()
+        new_chat_input = conversation.TITLE_PROMPT.format(query=u_input)
+        title_input = app_utils.gen_user_input(selected_chat, new_chat_input, False)
+        selected_chat, title_run = conversation.start_chat(title_input, settings, history)
+        settings.SELECTED_CHAT = selected_chat
+        settings.save()
         st.session_state["new_chat"] = False
 
     
@@ -298,39 +363,25 @@ def send_message(u_input : str, selected_chat : str):
 
     
     user_input = app_utils.gen_user_input(selected_chat, u_input, False)
+    selected_chat = conversation.send_turn(user_input, selected_chat, settings, history, title_run)
 
-    temp_input = json.dumps(user_input)
-    # Getting  AI's streamed response
-    new_chat_title,response = llm_chat(
-        user_input, settings, history.load_chat_history(selected_chat)
-    )
-
-    
-    # Add user input to the conversation history
-    user_input_id = history.add_user_input(selected_chat,  temp_input)
-    
-    
-    app_utils.print_ai_response(response,  selected_chat, history, user_input_id)
     history.load_chat_into_session_state(selected_chat)
 
-    if new_chat_title is None:
-        new_chat_title = ""
-
-    if new_chat_title != "":
-        settings.SELECTED_CHAT = new_chat_title
-        history.change_chat_name(selected_chat, new_chat_title)
+    if settings.SELECTED_CHAT != selected_chat:
+        settings.SELECTED_CHAT = selected_chat
         settings.save()
     
 
     st.rerun()
 
 def regenerate_response(user_input:dict):
-    """Regenerate the AI response."""
-    _,new_ai_response = llm_chat(
-                                user_input, settings, 
-                                history.load_chat_history(settings.SELECTED_CHAT)
-                            )
-    return new_ai_response
+    """Regenerate the AI response, returned as a stream of text chunks."""
+    # Regenerating asks for a new answer, so the response cache is bypassed
+    return llm_chat_stream(
+                            user_input, settings, 
+                            history.load_chat_history(settings.SELECTED_CHAT),
+                            use_cache=False,
+                        )
 
 
 
@@ -344,6 +395,12 @@ if settings.SELECTED_CHAT not in chat_history and len(chat_history) > 0:
     settings.save()
     history.load_chat_into_session_state(chat)
     st.session_state["new_chat"] = False
+
+# Older turns are only loaded on demand to keep long chats fast to open
+if not st.session_state["new_chat"] and st.session_state["history_cursor"] is not None:
+    if st.button("⬆️ Load earlier messages", key="load_earlier_messages"):
+        history.load_earlier_messages(settings.SELECTED_CHAT)
+
 app_utils.display_messages(settings.SELECTED_CHAT, regenerate_response, history, )#main_container)
 
 
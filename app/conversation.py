@@ -0,0 +1,85 @@
+import json
+import sqlite3
+import uuid
+import logging
+import app.app_utils as app_utils
+from app.dify import llm_chat_stream, llm_chat_background
+
+# ================= Chat Turns =================
+# The send-message flow of the chat page, kept out of the page script so it can be
+# reused (and benchmarked) without rendering the page.
+
+# Seconds the new-chat flow waits for the title once the first answer is complete
+TITLE_TIMEOUT = 30
+
+# Query of the workflow run generating the title of a new chat
+TITLE_PROMPT = "Can you generate single chat tilte for this user input: '{query}' \n I only need one chat title"
+
+
+def start_chat(title_input: dict, settings, history) -> tuple:
+    """
+    Start a new chat for its first message: the title is generated in the background,
+    concurrently with the answer, and the chat is created under a provisional title
+    until the turn is saved (see send_turn).
+
+    Args:
+        title_input (dict): The workflow inputs of the title run (see TITLE_PROMPT).
+
+    Returns:
+        tuple: (provisional chat title, title run future)
+    """
+    title_run = llm_chat_background(title_input, settings, [])
+    selected_chat = f"New chat {uuid.uuid4().hex[:8]}"
+    history.create_chat_session(selected_chat)
+    return selected_chat, title_run
+
+
+def send_turn(user_input: dict, selected_chat: str, settings, history, title_run=None) -> str:
+    """
+    Stream the answer to user_input into the page, then save the turn with a single
+    commit, renaming the chat to the generated title for the first turn of a new chat.
+
+    Args:
+        user_input (dict): The workflow inputs, as built by app_utils.gen_user_input.
+        selected_chat (str): The chat the turn belongs to.
+        title_run (Future): The title run returned by start_chat, for a new chat.
+
+    Returns:
+        str: The title of the chat after the turn.
+    """
+    temp_input = json.dumps(user_input)
+    # Getting  AI's streamed response
+    response = llm_chat_stream(
+        user_input, settings, history.load_chat_history(selected_chat)
+    )
+
+    # Stream the response before writing so the database isn't locked meanwhile
+    ai_streamed_response = app_utils.print_ai_response(response)
+    new_chat_title = response.new_chat_title
+
+    if title_run is not None:
+        # Usually done by now; otherwise only the rest of the title run is waited for
+        try:
+            new_chat_title, _ = title_run.result(timeout=TITLE_TIMEOUT)
+        except Exception as e:
+            title_run.cancel()
+            logging.warning(f"Chat title generation failed, keeping '{selected_chat}': {e}")
+
+    if new_chat_title is None:
+        new_chat_title = ""
+
+    # Save the whole turn with a single commit (on the background writer if enabled)
+    def save_turn():
+        # Add user input to the conversation history
+        user_input_id = history.add_user_input(selected_chat,  temp_input)
+        history.add_ai_response(selected_chat, user_input_id, ai_streamed_response)
+
+        if new_chat_title != "":
+            try:
+                history.change_chat_name(selected_chat, new_chat_title)
+                return new_chat_title
+            except sqlite3.IntegrityError:
+                logging.warning(f"Chat title '{new_chat_title}' already exists, keeping '{selected_chat}'.")
+        return selected_chat
+
+    return history.run_write(save_turn, wait=True)
@@ -0,0 +1,302 @@
+import os
+import sqlite3
+import hashlib
+import zlib
+import threading
+import logging
+import atexit
+from contextlib import contextmanager
+
+# Paths of the SQLite databases used by the app
+CHAT_HISTORY_DB = "app/data/chat_history.db"
+SETTINGS_DB = "app/data/settings.db"
+RESPONSE_CACHE_DB = "app/data/response_cache.db"
+
+# Pragmas applied to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",  # Readers don't block the writer and vice versa
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL, avoids an fsync on every commit
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # Memory-map up to 256 MB of the database
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",  # Wait for the write lock instead of failing
+    "PRAGMA foreign_keys = ON",  # Needed for ON DELETE CASCADE
+)
+
+# Idle connections kept per database for the next thread needing one; Streamlit runs
+# every rerun of a script in a new thread
+MAX_IDLE_CONNECTIONS = 8
+
+# AI responses of at least this many bytes are stored compressed and deduplicated
+# in the content_blobs table instead of inline in chat_messages.content
+COMPRESSION_THRESHOLD = 2048
+COMPRESSION_LEVEL = 6
+
+# Seconds between background incremental vacuum passes and pages freed per pass
+VACUUM_INTERVAL = 600
+VACUUM_PAGES = 2000
+
+
+def content_hash(content: str) -> str:
+    """Return the SHA-256 hex digest identifying a stored text."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compress_content(content: str) -> tuple:
+    """
+    Encode a text for the content_blobs table.
+
+    Returns:
+        tuple: (encoding, data) where encoding is "zlib", or "raw" if compressing didn't help.
+    """
+    raw = content.encode("utf-8")
+    data = zlib.compress(raw, COMPRESSION_LEVEL)
+    if len(data) < len(raw):
+        return "zlib", data
+    return "raw", raw
+
+
+def inflate(encoding: str, data: bytes):
+    """Decode a content_blobs row back into text (registered as the SQL function inflate)."""
+    if data is None:
+        return None
+    if encoding == "zlib":
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+def store_content(cursor: sqlite3.Cursor, content: str) -> tuple:
+    """
+    Prepare an AI response for storage in chat_messages.
+
+    Small responses are stored inline. Large ones are stored once per distinct text in
+    content_blobs, keyed by their hash, so regenerated versions with identical bodies
+    share a single compressed copy.
+
+    Returns:
+        tuple: (content, blob_hash) values for the chat_messages row.
+    """
+    if len(content.encode("utf-8")) < COMPRESSION_THRESHOLD:
+        return content, None
+
+    blob_hash = content_hash(content)
+    cursor.execute("SELECT 1 FROM content_blobs WHERE hash = ?", (blob_hash,))
+    if cursor.fetchone() is None:
+        encoding, data = compress_content(content)
+        cursor.execute(
+            "INSERT INTO content_blobs (hash, encoding, data) VALUES (?, ?, ?)",
+            (blob_hash, encoding, data)
+        )
+    return "", blob_hash
+
+
+class ConnectionManager:
+    """
+    Process-wide pool of open SQLite connections, handing out one per thread and database.
+
+    Streamlit runs every script run in a thread of its own, so a connection is checked
+    out by a thread for as long as the thread lives (sqlite3 connections must not be
+    used by two threads at once). Once the thread finished, its connection is returned
+    to the pool and checked out by the next thread needing one, so reruns reuse open
+    connections instead of reopening them and reapplying the pragmas. At most
+    MAX_IDLE_CONNECTIONS idle connections are kept per database.
+    """
+
+    def __init__(self, max_idle: int = MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (thread, db_path, connection), checked out
+        self._idle = {}  # db_path -> [connection]
+
+    def _open(self, db_path: str) -> sqlite3.Connection:
+        """Open a new connection to db_path, apply the tuned pragmas and register SQL functions."""
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # check_same_thread is off so that connections can move to another thread once
+        # the thread using them finished; a connection is still used by one thread at a time.
+        # isolation_level=None puts the connection in autocommit mode; multi-statement
+        # writes group themselves explicitly with transaction().
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("content_hash", 1, content_hash, deterministic=True)
+        conn.create_function("inflate", 2, inflate, deterministic=True)
+        logging.info(f"Opened SQLite connection to '{db_path}'.")
+        return conn
+
+    def get(self, db_path: str) -> sqlite3.Connection:
+        """Return the calling thread's connection to db_path, checking one out of the pool if needed."""
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        conn = connections.get(db_path)
+        if conn is None:
+            with self._lock:
+                self._prune()
+                idle = self._idle.get(db_path)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                conn = self._open(db_path)
+            connections[db_path] = conn
+            with self._lock:
+                self._connections.append((threading.current_thread(), db_path, conn))
+        return conn
+
+    @contextmanager
+    def transaction(self, db_path: str):
+        """
+        Run the enclosed statements on the calling thread's connection as one unit of work.
+
+        The outermost transaction takes the write lock up front (BEGIN IMMEDIATE) and
+        commits once when the block exits. Nested transactions become savepoints, so an
+        error caught inside an outer transaction only undoes the inner block.
+        """
+        conn = self.get(db_path)
+        depths = self._local.__dict__.setdefault("depths", {})
+        depth = depths.get(db_path, 0)
+        callbacks = self._local.__dict__.setdefault("callbacks", {}).setdefault(db_path, [])
+        pending = len(callbacks)
+        savepoint = f"sp_{depth}"
+
+        conn.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {savepoint}")
+        depths[db_path] = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            # Forget the after-commit callbacks of the writes being undone
+            del callbacks[pending:]
+            if depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            raise
+        else:
+            if depth == 0:
+                try:
+                    conn.execute("COMMIT")
+                except sqlite3.Error:
+                    del callbacks[:]
+                    conn.execute("ROLLBACK")
+                    raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+        finally:
+            depths[db_path] = depth
+
+        if depth == 0:
+            while callbacks:
+                callbacks.pop(0)()
+
+    def after_commit(self, db_path: str, callback):
+        """
+        Call callback once the calling thread's current transaction on db_path commits,
+        or right away if no transaction is open. Callbacks of rolled back work are dropped.
+        """
+        if self._local.__dict__.get("depths", {}).get(db_path, 0):
+            self._local.callbacks[db_path].append(callback)
+        else:
+            callback()
+
+    def _prune(self):
+        """Return the connections of threads which are no longer alive to the pool, closing the surplus."""
+        alive = []
+        for thread, db_path, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, db_path, conn))
+                continue
+            idle = self._idle.setdefault(db_path, [])
+            if len(idle) < self.max_idle:
+                if conn.in_transaction:
+                    # Left open by a thread that died inside a transaction
+                    conn.rollback()
+                idle.append(conn)
+            else:
+                conn.close()
+        self._connections = alive
+
+    def close_all(self):
+        """Close every pooled connection, e.g. when the process shuts down."""
+        with self._lock:
+            for thread, db_path, conn in self._connections:
+                conn.close()
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._connections = []
+            self._idle = {}
+        self._local = threading.local()
+
+
+connection_manager = ConnectionManager()
+atexit.register(connection_manager.close_all)
+
+
+def get_connection(db_path: str = CHAT_HISTORY_DB) -> sqlite3.Connection:
+    """Borrow the calling thread's pooled connection to db_path."""
+    return connection_manager.get(db_path)
+
+
+def transaction(db_path: str = CHAT_HISTORY_DB):
+    """Group writes to db_path into one commit; see ConnectionManager.transaction."""
+    return connection_manager.transaction(db_path)
+
+
+def after_commit(callback, db_path: str = CHAT_HISTORY_DB):
+    """Run callback after the current transaction on db_path commits; see ConnectionManager.after_commit."""
+    connection_manager.after_commit(db_path, callback)
+
+
+_vacuum_threads = {}
+_vacuum_lock = threading.Lock()
+
+
+def _vacuum_loop(db_path: str, interval: float, stop: threading.Event, maintenance):
+    """Periodically run the maintenance statements and return free pages of db_path to the file system."""
+    while not stop.wait(interval):
+        try:
+            if maintenance:
+                with transaction(db_path) as conn:
+                    for statement in maintenance:
+                        conn.execute(statement)
+            conn = get_connection(db_path)
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages:
+                # execute() stops after the first page freed; executescript runs it to the end
+                conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+                logging.info(f"Incremental vacuum of '{db_path}' freed up to {min(free_pages, VACUUM_PAGES)} pages.")
+        except sqlite3.Error as e:
+            logging.error(f"Incremental vacuum of '{db_path}' failed: {e}")
+
+
+def start_vacuum_thread(db_path: str = CHAT_HISTORY_DB, interval: float = VACUUM_INTERVAL, maintenance=()):
+    """
+    Start the background incremental vacuum of db_path once per process.
+
+    maintenance is a list of SQL statements (e.g. removing unreferenced rows) run in
+    one transaction before each vacuum pass.
+    """
+    with _vacuum_lock:
+        if db_path in _vacuum_threads:
+            return
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=_vacuum_loop, args=(db_path, interval, stop, list(maintenance)), name="incremental-vacuum", daemon=True
+        )
+        _vacuum_threads[db_path] = (thread, stop)
+        thread.start()
+
+
+def stop_vacuum_threads():
+    """Stop all background vacuum threads."""
+    with _vacuum_lock:
+        for thread, stop in _vacuum_threads.values():
+            stop.set()
+        _vacuum_threads.clear()
+
+
+atexit.register(stop_vacuum_threads)
@@ -2,10 +2,21 @@ import logging
 from logging.handlers import RotatingFileHandler
 import requests
 import json
+import threading
+import time
 import pytz
-from app.app_utils import throw_error
+import streamlit as st
+from app.app_utils import throw_error, WaitNotice
 from app.truncate import trancate
 from app.app_settings import AppSettings
+from app.dify_client import get_client
+from app.dify_async import submit, get_async_client
+from app.response_cache import get_response_cache, request_key
+from app.singleflight import SingleFlight
+from app.run_tracker import get_run_tracker
+from app.writer import current_session_key
+from app.dify_metrics import get_metrics, capture_payloads
+from app.dify_admission import get_admission, is_backend_failure, is_failed_run, DifyUnavailable, WAITING_MESSAGE
 
 # ================= Logging Configuration =================
 
@@ -28,81 +39,554 @@ logger.addHandler(handler)
 
 # ================= Initialize Dify Chat =================
 
+NO_RESPONSE = "Dify did not return any response. try rephrasing your query or regenerate your response. or delete the chat and start a new one."
+
+# The "user" every workflow run is made on behalf of
+DIFY_USER = "RearchFlow"
+
+# Seconds between heartbeats of a stream waiting for Dify, which let Streamlit stop
+# the script of a session that moved on (it can only do so when the script updates the page)
+HEARTBEAT_INTERVAL = 1.0
+
+# Seconds a run whose every caller stopped iterating is kept before it is stopped in
+# Dify: a rerun or a double click re-issues the same request right after the script
+# was stopped, and should join the run instead of starting another
+ABANDON_GRACE = 5.0
+
+# Identical runs in flight at the same time, from any session, share one Dify call
+_stream_flights = SingleFlight()
+
+
+def _workflow_request(user_input: dict, messages: list, response_mode: str):
+    """
+    Build the body of a /workflows/run call.
+    """
+    user_input["ChatHistory"] = trancate(user_input["Query"], messages)
+
+    # user_input["Paper"] = {}
+
+    data = {
+        "inputs": user_input,
+        "response_mode": response_mode,
+        "user": DIFY_USER,
+        
+    }
+    return data
+
+
+def _parse_outputs(outputs: dict):
+    """
+    Turn the outputs of a finished workflow run into (new_chat_title, response),
+    appending the knowledge graph to the response.
+    """
+    if not outputs:
+        return "", NO_RESPONSE
+
+    response = outputs.get("response", "")
+    new_chat_title = outputs.get("new_chat_title", "")
+    graph = outputs.get("graph", "")
+
+    if graph:
+        response = f"{response} \n\n ### Visualization of Database\n{graph}"
+    return new_chat_title, response
+
+
+def _cached_outputs(data: dict, settings: AppSettings, use_cache: bool):
+    """
+    Look a run up in the response cache, if it is enabled in the settings.
+
+    Returns:
+        tuple: (key, outputs). key is None when the cache is off; outputs is None on a
+        miss or when use_cache is False (the fresh outputs are still cached under key).
+    """
+    if settings.RESPONSE_CACHE != "True":
+        return None, None
+
+    cache = get_response_cache()
+    key = request_key(data, settings.DIFY_API_URL, settings.DIFY_API_KEY)
+    if not use_cache:
+        cache.bypass()
+        return key, None
+    return key, cache.get(key)
+
+
+def _cache_run(key: str, run: dict):
+    """Cache the outputs of a finished run ("data" of a blocking response) if it succeeded."""
+    if key is not None and run.get("outputs") and run.get("status", "succeeded") == "succeeded":
+        get_response_cache().put(key, run["outputs"])
+
+
 def llm_chat(
     user_input: dict,
     settings: AppSettings = None,
     messages: list = [],
+    use_cache: bool = True,
 ):
+    """
+    Run the workflow and wait for its outputs.
+
+    The run is streamed internally: Dify only tells the task_id of a blocking run once
+    it finished, too late to stop it when the session moves on meanwhile.
+
+    Returns:
+        tuple: (new_chat_title, response)
+    """
     logging.info("==============LLM Chat ============")
 
-    dify_api_url: str = settings.DIFY_API_URL
-    dify_api_key: str = settings.DIFY_API_KEY
-    # new_chat: bool = user_input["new_chat"]
-    
-    user_input["ChatHistory"] = trancate(user_input["Query"], messages)
-    
-    # user_input["Paper"] = {}
+    stream = llm_chat_stream(user_input, settings, messages, use_cache)
+    heartbeat = st.empty()
+    last_heartbeat = time.monotonic()
+    for _ in stream:
+        if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+            heartbeat.empty()
+            last_heartbeat = time.monotonic()
 
-    headers = {
-        "Authorization": f"Bearer {dify_api_key}",
-        "Content-Type": "application/json",
-    }
+    return stream.new_chat_title, stream.response
 
-    data = {
-        "inputs": user_input,
-        "response_mode": "blocking",
-        "user": "RearchFlow",
-        
-    }
 
-    logging.info(f"Data: {json.dumps(data, indent=4)}")
+# ================= Streaming Dify Chat =================
 
-    response = ""
-    new_chat_title = ""
+def _iter_sse_events(api_call: requests.Response):
+    """
+    Yield (event, size) for the server-sent events of a streaming response: the JSON
+    payload of each event, and the bytes received since the previous one.
+    """
+    size = 0
+    # chunk_size=None hands over data as soon as it arrives
+    for line in api_call.iter_lines(chunk_size=None):
+        size += len(line) + 1
+        if not line.startswith(b"data:"):
+            continue  # Blank separators and "event: ping" keep-alives
+        try:
+            yield json.loads(line[len(b"data:"):]), size
+        except json.JSONDecodeError as e:
+            logging.error(f"Failed to parse streamed event: {e}")
+        size = 0
 
 
-    try:
-        # Perform the API call
-        dify_api_url = f"{dify_api_url}/workflows/run"
-        logger.info(f"API URL: {dify_api_url}")
-        api_call = requests.post(
-            dify_api_url, headers=headers, data=json.dumps(data), timeout=180
-        )
-        logging.info(f"API Call: {api_call}")
-        response_text = api_call.text
-        logging.info(f"Raw response: {response_text}")
-
-        # Check if the call was successful
-        if api_call.status_code == 200:
-            # Extract the "answer" part of the response
-            data = api_call.json()["data"]
-            logging.info(
-                f"After initial interaction, api_call: {json.dumps(api_call.json(), indent=4)}"
+class WorkflowStream:
+    """
+    A streaming workflow run, consumed by iterating over it.
+
+    Iterating yields the response text as Dify generates it (text_chunk events). Once
+    the iteration ends, new_chat_title and response hold the final outputs of the run
+    (workflow_finished event) as llm_chat returns them; whatever part of the final
+    response wasn't streamed, such as the graph, is yielded last. failed then tells
+    whether the run failed: a failed or errored workflow_finished, an error event, or a
+    stream ending without workflow_finished unless the run was stopped.
+
+    A stream created with the outputs of a cached run yields the whole response at once.
+    Streams of actual runs record their metrics (see dify_metrics) once they end; started
+    is when the request was sent, request_bytes the size of its body.
+    """
+
+    def __init__(
+        self,
+        api_call: requests.Response = None,
+        cache_key: str = None,
+        outputs: dict = None,
+        client=None,
+        started: float = None,
+        request_bytes: int = None,
+        capture: bool = False,
+    ):
+        self._api_call = api_call
+        self._cache_key = cache_key
+        self._outputs = outputs
+        self._client = client
+        self._started = started if started is not None else time.monotonic()
+        self._request_bytes = request_bytes
+        self._capture = capture
+        self._stop_requested = False
+        self._stop_sent = False
+        self._lock = threading.Lock()
+        self.task_id = None
+        self.failed = False
+        self.new_chat_title = ""
+        self.response = ""
+
+    def stop(self):
+        """
+        Stop the run in Dify, which then ends the stream. If the task_id isn't known yet,
+        the run is stopped as soon as its first event arrives. Returns right away: the
+        stop request (retried if Dify is slow or down) is sent from a background thread,
+        as stop() is called from widget callbacks (see abandon_runs).
+        """
+        with self._lock:
+            self._stop_requested = True
+            send = self.task_id is not None
+        if send:
+            self._send_stop()
+
+    def _send_stop(self):
+        # The pump thread and stop() can both get here; the stop is sent once
+        with self._lock:
+            if self._stop_sent:
+                return
+            self._stop_sent = True
+        threading.Thread(target=self._post_stop, name="dify-stop", daemon=True).start()
+
+    def _post_stop(self):
+        try:
+            response = self._client.stop_task(self.task_id, DIFY_USER)
+            if response.status_code == 200:
+                logging.info(f"Stopped Dify workflow task {self.task_id}.")
+                return
+            logging.warning(f"Could not stop Dify workflow task {self.task_id}: {response.status_code} {response.text}")
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Could not stop Dify workflow task {self.task_id}: {e}")
+        # At least stop reading a run that goes on
+        self._api_call.close()
+
+    def __iter__(self):
+        if self._outputs is not None:
+            self.new_chat_title, self.response = _parse_outputs(self._outputs)
+            yield self.response
+            return
+        if self._api_call is None:
+            return
+
+        streamed = ""
+        finished = False
+        run = {}
+        response_bytes = 0
+        first_chunk = None
+        try:
+            for event, size in _iter_sse_events(self._api_call):
+                response_bytes += size
+                if self._capture:
+                    logging.debug(f"Dify streamed event: {json.dumps(event, ensure_ascii=False)}")
+                if self.task_id is None and event.get("task_id"):
+                    with self._lock:
+                        self.task_id = event["task_id"]
+                        send = self._stop_requested
+                    if send:
+                        self._send_stop()
+                kind = event.get("event")
+                if kind == "text_chunk":
+                    text = event.get("data", {}).get("text", "")
+                    streamed += text
+                    if first_chunk is None:
+                        first_chunk = time.monotonic() - self._started
+                    yield text
+                elif kind == "workflow_finished":
+                    run = event.get("data", {})
+                    if is_failed_run(run):
+                        self.failed = True
+                        logging.error(f"Workflow run failed: {run.get('error')}")
+                    self.new_chat_title, self.response = _parse_outputs(run.get("outputs"))
+                    _cache_run(self._cache_key, run)
+                    finished = True
+                elif kind == "error":
+                    self.failed = True
+                    logging.error(f"Workflow stream error {event.get('status')}: {event.get('message')}")
+        except requests.exceptions.RequestException as e:
+            if not self._stop_sent:
+                logging.error(f"LLM_Chat: An error occurred while streaming the response: {e}")
+        finally:
+            if not finished and not self._stop_sent:
+                # The stream broke off (or was cut) before the run finished
+                self.failed = True
+            self._api_call.close()
+            get_metrics().record(
+                "workflow",
+                time.monotonic() - self._started,
+                run.get("status", "stopped" if self._stop_sent else "incomplete"),
+                request_bytes=self._request_bytes,
+                response_bytes=response_bytes,
+                first_chunk=first_chunk,
+                total_tokens=run.get("total_tokens"),
+                elapsed=run.get("elapsed_time"),
             )
 
-            # outputs = json.loads(data)
+        if not finished:
+            self.response = streamed or NO_RESPONSE
+        if self.response.startswith(streamed) and len(self.response) > len(streamed):
+            yield self.response[len(streamed):]
 
-            if data["outputs"]:
 
+class SharedStream:
+    """
+    Fans one WorkflowStream out to every caller that joined the run. A background thread
+    reads the stream into a buffer, so the run completes even if a caller stops
+    iterating; each iteration replays the buffer, then follows the new chunks.
 
-                response = data["outputs"].get("response", "")
-                new_chat_title = data["outputs"].get("new_chat_title", "")
-                graph = data["outputs"].get("graph", "")
+    The sessions that joined own the run, once per call that joined it. A call leaves
+    when its iteration ends early (its script was stopped or rerun); once no call waits
+    for the run any more, it is stopped in Dify after ABANDON_GRACE seconds, unless a
+    call joins it again meanwhile (the rerun re-issuing the request). A session
+    abandoning the run through the RunTracker gives up all its calls, and the run is
+    stopped right away if no other session waits for it. Iterating yields "" every
+    HEARTBEAT_INTERVAL while no text arrives, so the consuming script keeps updating
+    the page meanwhile.
 
-                if graph:
-                    response = f"{response} \n\n ### Visualization of Database\n{graph}"
+    new_chat_title and response are those of the WorkflowStream once iterating ended.
+    on_finished is called once the run can't be joined any more, on_done(stream) once
+    the run ended.
+    """
+
+    def __init__(self, stream: WorkflowStream, on_finished=None, on_done=None):
+        self._stream = stream
+        self._on_finished = on_finished
+        self._on_done = on_done
+        self._chunks = []
+        self._owners = {}  # session key -> calls of the session waiting for the run
+        self._finished = False
+        self._stopped = False
+        self._stop_timer = None
+        self._condition = threading.Condition()
+        threading.Thread(target=self._pump, name="dify-stream", daemon=True).start()
+
+    @property
+    def new_chat_title(self):
+        return self._stream.new_chat_title
+
+    @property
+    def response(self):
+        return self._stream.response
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def join(self, owner) -> bool:
+        """Add a call of owner to the calls waiting for the run, cancelling a pending stop; False if it was already stopped."""
+        with self._condition:
+            if self._stopped:
+                return False
+            if self._stop_timer is not None:
+                self._stop_timer.cancel()
+                self._stop_timer = None
+            self._owners[owner] = self._owners.get(owner, 0) + 1
+            return True
+
+    def leave(self, owner):
+        """A call of owner stopped iterating early; the run is stopped ABANDON_GRACE seconds after the last one."""
+        with self._condition:
+            if self._owners.get(owner, 0) > 1:
+                self._owners[owner] -= 1
             else:
-                response = "Dify did not return any response. try rephrasing your query or regenerate your response. or delete the chat and start a new one."
+                self._owners.pop(owner, None)
+            if self._owners or self._finished or self._stopped or self._stop_timer is not None:
+                return
+            self._stop_timer = threading.Timer(ABANDON_GRACE, self._stop_if_abandoned)
+            self._stop_timer.daemon = True
+            self._stop_timer.start()
+
+    def abandon(self, owner):
+        """Give the run up on behalf of every call of owner, stopping it if no other session waits for it."""
+        with self._condition:
+            self._owners.pop(owner, None)
+        self._stop_if_abandoned()
+
+    def _stop_if_abandoned(self):
+        with self._condition:
+            stop = not self._owners and not self._finished and not self._stopped
+            if stop:
+                self._stopped = True
+        if stop:
+            logging.info("Every session waiting for a Dify run moved on; stopping it.")
+            self._finish_flight()
+            self._stream.stop()
+
+    def _finish_flight(self):
+        # No longer joinable: later identical calls start a run of their own
+        with self._condition:
+            on_finished, self._on_finished = self._on_finished, None
+        if on_finished is not None:
+            on_finished()
+
+    def _pump(self):
+        try:
+            for chunk in self._stream:
+                with self._condition:
+                    self._chunks.append(chunk)
+                    self._condition.notify_all()
+        except Exception as e:
+            logging.error(f"LLM_Chat: An error occurred while streaming the response: {e}")
+        finally:
+            self._finish_flight()
+            if self._on_done is not None:
+                self._on_done(self._stream)
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def __iter__(self):
+        owner = current_session_key()
+        index = 0
+        complete = False
+        try:
+            while True:
+                with self._condition:
+                    if index == len(self._chunks) and not self._finished:
+                        self._condition.wait(HEARTBEAT_INTERVAL)
+                    chunks = self._chunks[index:]
+                    complete = not chunks and self._finished
+                if complete:
+                    return
+                index += len(chunks)
+                yield "".join(chunks)
+        finally:
+            if not complete:
+                self.leave(owner)
+
 
-        else:
-            logging.error(f"Error {api_call.status_code}: {api_call.text}")
-            throw_error(f"Error {api_call.status_code}: {api_call.text}")
+def llm_chat_stream(
+    user_input: dict,
+    settings: AppSettings = None,
+    messages: list = [],
+    use_cache: bool = True,
+) -> WorkflowStream:
+    """
+    Run the workflow in streaming mode, so the answer can be shown while it is generated.
+
+    Returns:
+        WorkflowStream: Iterate over it for the text chunks; the title is available afterwards.
+        Identical runs in flight at the same time share one Dify call (see SharedStream),
+        which is stopped if the session moves on before it finished.
+    """
+    logging.info("==============LLM Chat (streaming) ============")
+
+    data = _workflow_request(user_input, messages, "streaming")
+
+    cache_key, cached = _cached_outputs(data, settings, use_cache)
+    if cached is not None:
+        logging.info("LLM_Chat: answered from the response cache.")
+        return WorkflowStream(outputs=cached)
+
+    capture = capture_payloads()
+    if capture:
+        logging.debug(f"Dify workflow request: {json.dumps(data, ensure_ascii=False)}")
+
+    client = get_client(settings.DIFY_API_URL, settings.DIFY_API_KEY)
+    flight_key = request_key(data, settings.DIFY_API_URL, settings.DIFY_API_KEY)
+    session_key = current_session_key()
+    admission = get_admission()
+
+    def run():
+        # Wait for a free slot, showing the wait; the slot is held until the whole run was streamed
+        notice = WaitNotice(WAITING_MESSAGE)
+        try:
+            probe = admission.acquire(session_key, on_wait=notice)
+        finally:
+            notice.clear()
+        started = time.monotonic()
+        # Same size as the body requests sends
+        request_bytes = len(json.dumps(data))
+        try:
+            # The read timeout applies between two chunks, not to the whole run
+            api_call = client.run_workflow(data, stream=True)
+        except requests.exceptions.RequestException:
+            admission.release(False, probe)
+            get_metrics().record("workflow", time.monotonic() - started, "error", request_bytes=request_bytes)
+            raise
+        if api_call.status_code != 200:
+            admission.release(not is_backend_failure(api_call.status_code), probe)
+            get_metrics().record(
+                "workflow", time.monotonic() - started, api_call.status_code,
+                request_bytes=request_bytes, response_bytes=len(api_call.content),
+            )
+            _stream_flights.release(flight_key)
+            return api_call
+        # Joinable until the run finished; later callers get the chunks streamed so far first
+        stream = WorkflowStream(api_call, cache_key, client=client, started=started, request_bytes=request_bytes, capture=capture)
+        return SharedStream(
+            stream,
+            on_finished=lambda: _stream_flights.release(flight_key),
+            on_done=lambda finished: admission.release(not finished.failed, probe),
+        )
+
+    try:
+        # A second attempt starts a new run if the shared one was stopped right before we joined it
+        for _ in range(2):
+            stream, shared = _stream_flights.do(flight_key, run, hold=True)
+            if isinstance(stream, requests.Response) or stream.join(session_key):
+                break
     except requests.exceptions.RequestException as e:
         logging.error(f"LLM_Chat: An error occurred during the API call: {e}")
-    except json.JSONDecodeError as e:
-        logging.error(f"Failed to parse JSON: {e}")
+        return WorkflowStream()
+    except DifyUnavailable as e:
+        # Dify is saturated or failing: tell the user right away instead of piling up
+        logging.warning(f"LLM_Chat: run refused: {e}")
+        throw_error(str(e))
+        return WorkflowStream()  # Only reached outside of a Streamlit script run
+
+    if isinstance(stream, requests.Response):
+        logging.error(f"Error {stream.status_code}: {stream.text}")
+        throw_error(f"Error {stream.status_code}: {stream.text}")
+        return WorkflowStream()  # Only reached outside of a Streamlit script run
+    if shared:
+        logging.info("LLM_Chat: sharing the stream of an identical run in flight.")
+    get_run_tracker().track(session_key, lambda: stream.finished, lambda: stream.abandon(session_key), run=stream)
+    return stream
+
+
+def abandon_runs():
+    """
+    Abandon the outstanding workflow runs of the current session, e.g. when the user
+    switches or deletes the chat they were started for.
+    """
+    return get_run_tracker().abandon(current_session_key())
+
+
+# ================= Async Dify Chat =================
+
+async def llm_chat_async(
+    user_input: dict,
+    settings: AppSettings = None,
+    messages: list = [],
+    client=None,
+    use_cache: bool = True,
+    session_key=None,
+):
+    """
+    Coroutine version of llm_chat, so independent workflow runs can be awaited together:
+
+        (title, _), (_, answer) = await asyncio.gather(
+            llm_chat_async(title_input, settings), llm_chat_async(user_input, settings, messages)
+        )
+
+    Args:
+        client (AsyncDifyClient): The client to use. Defaults to the client of the
+            background event loop (see llm_chat_background); pass your own when running
+            on another event loop, e.g. in asyncio.run().
+        session_key: The session the run is queued for by the admission controller.
+
+    Returns:
+        tuple: (new_chat_title, response) like llm_chat.
+
+    Raises:
+        httpx.HTTPError: If the run fails; nothing is shown in the UI.
+        dify_admission.DifyUnavailable: If Dify is failing or saturated.
+    """
+    data = _workflow_request(user_input, messages, "streaming")
+    cache_key, cached = _cached_outputs(data, settings, use_cache)
+    if cached is not None:
+        return _parse_outputs(cached)
 
+    if client is None:
+        client = get_async_client(settings.DIFY_API_URL, settings.DIFY_API_KEY)
+    result = await client.run_workflow(data, session_key)
+    _cache_run(cache_key, result)
+    return _parse_outputs(result.get("outputs"))
 
-    return new_chat_title,response
 
-    
\ No newline at end of file
+def llm_chat_background(
+    user_input: dict,
+    settings: AppSettings = None,
+    messages: list = [],
+    use_cache: bool = True,
+):
+    """
+    Start llm_chat_async on the background event loop and return right away, so the
+    script can do other work (e.g. stream another run) meanwhile.
+
+    Returns:
+        concurrent.futures.Future: Resolves to (new_chat_title, response); cancel() stops the
+        run, as does abandon_runs() in the session that started it.
+    """
+    session_key = current_session_key()
+    future = submit(llm_chat_async(user_input, settings, messages, use_cache=use_cache, session_key=session_key))
+    get_run_tracker().track(session_key, future.done, future.cancel)
+    return future
@@ -0,0 +1,293 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+
+# ================= Dify Admission Control =================
+# Every session used to call Dify on its own, so a slow backend piled up blocked script
+# threads. Workflow runs and uploads now pass one process-wide AdmissionController: it
+# caps the calls in flight, queues the others fairly across sessions, and a circuit
+# breaker fails calls fast while Dify is failing or timing out.
+
+# Dify calls (workflow runs, uploads) in flight at the same time, across all sessions
+MAX_CONCURRENT_CALLS = 8
+# Seconds a call waits in the queue for a free slot before giving up
+QUEUE_TIMEOUT = 60
+# Seconds between two on_wait calls of a call waiting for a slot (see AdmissionController.acquire)
+WAIT_NOTIFY_INTERVAL = 1.0
+
+# The breaker opens when at least BREAKER_MIN_CALLS calls finished in the last
+# BREAKER_WINDOW seconds and BREAKER_FAILURE_RATE of them failed
+BREAKER_WINDOW = 60
+BREAKER_MIN_CALLS = 10
+BREAKER_FAILURE_RATE = 0.5
+# Seconds the breaker stays open before letting one trial call through
+BREAKER_COOLDOWN = 30
+
+UNAVAILABLE_MESSAGE = "The research assistant is not responding right now. Please try again in a minute."
+BUSY_MESSAGE = "The research assistant is busy with other requests. Please try again in a moment."
+WAITING_MESSAGE = "The research assistant is busy with other requests; waiting for a free slot..."
+
+
+class DifyUnavailable(Exception):
+    """A Dify call was refused before being sent; the message can be shown to the user."""
+
+
+def is_backend_failure(status_code: int) -> bool:
+    """Return whether an HTTP status means Dify is failing or overloaded (counted by the breaker)."""
+    return status_code >= 500 or status_code == 429
+
+
+def is_failed_run(run: dict) -> bool:
+    """Return whether a workflow run (the data of its workflow_finished event) failed."""
+    return bool(run.get("error")) or run.get("status") == "failed"
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent Dify calls. Closed, calls go through; open, they are
+    refused until BREAKER_COOLDOWN passed; then half-open, a single trial call (the
+    probe) goes through and its outcome closes the breaker or opens it again. Calls
+    admitted before the breaker opened may still finish meanwhile; they don't decide.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        window: float = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        cooldown: float = BREAKER_COOLDOWN,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._outcomes = deque()  # (time, ok) of the calls of the window
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self) -> bool:
+        """
+        Raise DifyUnavailable if calls are currently refused.
+
+        Returns:
+            bool: Whether the call is the probe of the half-open breaker; pass it to record().
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+        raise DifyUnavailable(UNAVAILABLE_MESSAGE)
+
+    def record(self, ok, probe: bool = False):
+        """
+        Record the outcome of a call: True, False, or None if it was never sent. Only
+        the outcome of the probe (see check()) closes or reopens a half-open breaker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if probe and self.state == self.HALF_OPEN:
+                # A probe that was never sent leaves the next call to probe
+                self._probing = False
+                if ok is None:
+                    return
+                self._outcomes.clear()
+                if ok:
+                    self.state = self.CLOSED
+                    logging.info("Dify circuit breaker closed.")
+                else:
+                    self._open(now)
+                return
+            if ok is None:
+                return
+
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(not outcome for _, outcome in self._outcomes)
+            if (
+                self.state == self.CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures >= self.failure_rate * len(self._outcomes)
+            ):
+                self._open(now)
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probing = False
+        logging.warning(f"Dify circuit breaker open: calls are refused for {self.cooldown}s.")
+
+
+class _Waiter:
+    def __init__(self, session_key, on_grant=None):
+        self.session_key = session_key
+        self.on_grant = on_grant
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Admits at most max_concurrent Dify calls at a time. Calls beyond that wait in one
+    queue per session, served round-robin, so a session issuing many calls doesn't
+    starve the others. Every admitted call must be released, with its outcome and
+    whether it was the probe of the circuit breaker:
+
+        probe = admission.acquire(session_key)  # raises DifyUnavailable
+        try:
+            ...
+        finally:
+            admission.release(ok, probe)
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_CALLS, queue_timeout: float = QUEUE_TIMEOUT, breaker: CircuitBreaker = None):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._active = 0
+        self._queues = OrderedDict()  # session key -> deque of waiters, in round-robin order
+        self._condition = threading.Condition()
+        self.timeouts = 0
+
+    def _enqueue(self, waiter: _Waiter):
+        self._queues.setdefault(waiter.session_key, deque()).append(waiter)
+        self._grant()
+
+    def _grant(self):
+        # Called with the condition held: hand free slots out, one session at a time
+        while self._active < self.max_concurrent and self._queues:
+            session_key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(session_key)
+            else:
+                del self._queues[session_key]
+            waiter.granted = True
+            self._active += 1
+            if waiter.on_grant is not None:
+                waiter.on_grant()
+        self._condition.notify_all()
+
+    def _withdraw(self, waiter: _Waiter):
+        # Called with the condition held, for a waiter that gave up
+        waiters = self._queues.get(waiter.session_key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._queues[waiter.session_key]
+
+    def _give_up(self, waiter: _Waiter, probe: bool):
+        # A waiter stopped waiting (timed out or interrupted)
+        with self._condition:
+            if waiter.granted:
+                # Granted while giving up: hand the slot on
+                self._active -= 1
+                self._grant()
+            else:
+                self._withdraw(waiter)
+        self.breaker.record(None, probe)
+
+    def acquire(self, session_key, on_wait=None) -> bool:
+        """
+        Wait for a slot on behalf of session_key.
+
+        Args:
+            on_wait (callable): Called with the seconds waited so far, every
+                WAIT_NOTIFY_INTERVAL while the call is queued, outside of any lock; lets
+                a script show the wait and be stopped meanwhile (see app_utils.WaitNotice).
+
+        Returns:
+            bool: Whether the call is the probe of the circuit breaker; pass it to release().
+
+        Raises:
+            DifyUnavailable: If the circuit breaker is open or no slot freed up in time.
+        """
+        probe = self.breaker.check()
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        waiter = _Waiter(session_key)
+        with self._condition:
+            self._enqueue(waiter)
+        try:
+            while True:
+                with self._condition:
+                    remaining = deadline - time.monotonic()
+                    if not waiter.granted and remaining > 0:
+                        self._condition.wait(min(remaining, WAIT_NOTIFY_INTERVAL) if on_wait else remaining)
+                    if waiter.granted:
+                        return probe
+                    if time.monotonic() >= deadline:
+                        self.timeouts += 1
+                        raise DifyUnavailable(BUSY_MESSAGE)
+                if on_wait is not None:
+                    on_wait(time.monotonic() - started)
+        except BaseException:
+            self._give_up(waiter, probe)
+            raise
+
+    async def acquire_async(self, session_key) -> bool:
+        """acquire() for coroutines: waits without blocking the event loop."""
+        probe = self.breaker.check()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = _Waiter(session_key, on_grant)
+        with self._condition:
+            self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(granted, self.queue_timeout)
+        except BaseException as e:
+            self._give_up(waiter, probe)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise DifyUnavailable(BUSY_MESSAGE) from None
+            raise
+        return probe
+
+    def release(self, ok, probe: bool = False):
+        """Free the slot of an admitted call and record its outcome (see CircuitBreaker.record)."""
+        with self._condition:
+            self._active -= 1
+            self._grant()
+        self.breaker.record(ok, probe)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "active": self._active,
+                "max_concurrent": self.max_concurrent,
+                "queued": sum(len(waiters) for waiters in self._queues.values()),
+                "queued_sessions": len(self._queues),
+                "queue_timeouts": self.timeouts,
+                "breaker": self.breaker.state,
+                "breaker_rejections": self.breaker.rejected,
+            }
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Return the process-wide AdmissionController."""
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionController()
+        return _admission
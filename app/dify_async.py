@@ -0,0 +1,238 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+import httpx
+from app.dify_client import (
+    CONNECT_TIMEOUT,
+    READ_TIMEOUT,
+    MAX_RETRIES,
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    POOL_SIZE,
+    retry_after,
+    should_retry_status,
+    backoff_delay,
+)
+from app.singleflight import AsyncSingleFlight
+from app.dify_metrics import get_metrics
+from app.dify_admission import get_admission, is_backend_failure, is_failed_run
+
+# ================= Asyncio Dify Client =================
+
+# Workflow runs one AsyncDifyClient sends to Dify at the same time
+MAX_CONCURRENCY = 4
+
+
+class AsyncDifyClient:
+    """
+    Asyncio counterpart of dify_client.DifyClient, built on httpx, for issuing independent
+    workflow runs concurrently and awaiting them together:
+
+        async with AsyncDifyClient(url, key) as client:
+            first, second = await asyncio.gather(client.run_workflow(a), client.run_workflow(b))
+
+    At most max_concurrency requests are in flight; the others wait for a slot. Retries
+    follow the same rules as DifyClient; a streamed run is only retried before its events
+    started arriving. Cancelling the awaiting task aborts the request.
+    Identical workflow runs awaited at the same time share one request.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        max_concurrency: int = MAX_CONCURRENCY,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._flights = AsyncSingleFlight()
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def request(self, method: str, path: str, idempotent: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request to the Dify API once a concurrency slot is free, retrying transient
+        failures like DifyClient.request.
+
+        Returns:
+            httpx.Response: The last response, which may still be an error status.
+        """
+        async with self._semaphore:
+            return await self._send(method, path, idempotent, **kwargs)
+
+    async def _send(self, method: str, path: str, idempotent: bool = False, stream: bool = False, **kwargs) -> httpx.Response:
+        # The retry loop of request(), called with a concurrency slot held. With stream,
+        # the body of the returned response isn't read yet; the caller must close it.
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self._client.send(self._client.build_request(method, path, **kwargs), stream=stream)
+            except httpx.TransportError as e:
+                # Connect errors mean the request never reached Dify
+                not_sent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if last_attempt or not (idempotent or not_sent):
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                logging.warning(f"Dify {method} {path} failed ({e!r}); retrying in {delay:.1f}s.")
+            else:
+                if last_attempt or not should_retry_status(response.status_code, idempotent):
+                    return response
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after(response.headers))
+                logging.warning(f"Dify {method} {path} returned {response.status_code}; retrying in {delay:.1f}s.")
+                await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def run_workflow(self, data: dict, session_key=None) -> dict:
+        """
+        Run the workflow (POST /workflows/run) and return once it finished, or await the
+        identical run already in flight. The run is streamed, so its task_id is known
+        early and cancelling it stops the run in Dify too.
+
+        Returns:
+            dict: The "data" of the run, with its "outputs".
+
+        Like every Dify call, the run first waits for a slot of the process-wide admission
+        controller, queued with the other calls of session_key.
+
+        Raises:
+            httpx.HTTPError: If the run failed or Dify answered with an error status.
+            dify_admission.DifyUnavailable: If the run was refused (Dify failing or saturated).
+        """
+        key = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return await self._flights.do(key, lambda: self._run_workflow(data, session_key))
+
+    async def _run_workflow(self, data: dict, session_key=None) -> dict:
+        admission = get_admission()
+        probe = await admission.acquire_async(session_key)
+        task_id = None
+        run = {}
+        status = "incomplete"
+        # Outcome for the circuit breaker: a stream ending without workflow_finished failed
+        ok = False
+        started = time.monotonic()
+        try:
+            async with contextlib.aclosing(self.stream_workflow({**data, "response_mode": "streaming"})) as events:
+                async for event in events:
+                    task_id = task_id or event.get("task_id")
+                    if event.get("event") == "workflow_finished":
+                        run = event.get("data", {})
+                        status = run.get("status", status)
+                        ok = not is_failed_run(run)
+                        return run
+        except asyncio.CancelledError:
+            # Stopped on purpose, which says nothing about Dify's health
+            status = "stopped"
+            ok = True
+            if task_id:
+                await self.stop_task(task_id, data.get("user", ""))
+            raise
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            ok = not is_backend_failure(status)
+            raise
+        except httpx.HTTPError:
+            status = "error"
+            ok = False
+            raise
+        finally:
+            admission.release(ok, probe)
+            get_metrics().record(
+                "workflow_async",
+                time.monotonic() - started,
+                status,
+                request_bytes=len(json.dumps(data)),
+                total_tokens=run.get("total_tokens"),
+                elapsed=run.get("elapsed_time"),
+            )
+        return run
+
+    async def stop_task(self, task_id: str, user: str):
+        """Stop a running workflow (POST /workflows/tasks/{task_id}/stop), logging failures."""
+        try:
+            response = await self.request("POST", f"/workflows/tasks/{task_id}/stop", idempotent=True, json={"user": user})
+            response.raise_for_status()
+            logging.info(f"Stopped Dify workflow task {task_id}.")
+        except httpx.HTTPError as e:
+            logging.warning(f"Could not stop Dify workflow task {task_id}: {e!r}")
+
+    async def stream_workflow(self, data: dict):
+        """
+        Run the workflow in streaming mode and yield its server-sent events as dicts
+        (text_chunk, workflow_finished, ...) as they arrive. Failures before the stream
+        started (never sent, 429/502/503) are retried like DifyClient does for runs.
+
+        Close the generator when leaving it early (contextlib.aclosing), so the
+        concurrency slot and the connection are freed right away.
+        """
+        async with self._semaphore:
+            response = await self._send("POST", "/workflows/run", stream=True, json=data)
+            try:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        yield json.loads(line[len("data:"):].strip())
+            finally:
+                await response.aclose()
+
+
+# ================= Background Event Loop =================
+# Streamlit scripts are synchronous. Coroutines submitted here run concurrently on one
+# process-wide event loop thread, whose AsyncDifyClients keep their pooled connections.
+
+_loop = None
+_loop_lock = threading.Lock()
+_clients = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="dify-async", daemon=True).start()
+        return _loop
+
+
+def submit(coroutine):
+    """
+    Run a coroutine on the background event loop.
+
+    Returns:
+        concurrent.futures.Future: Its result; cancel() cancels the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+
+def get_async_client(base_url: str, api_key: str) -> AsyncDifyClient:
+    """
+    Return the AsyncDifyClient of the background event loop for a Dify API URL and key.
+    Only use it in coroutines passed to submit(); other event loops need their own client.
+    """
+    with _loop_lock:
+        key = (base_url, api_key)
+        if key not in _clients:
+            _clients[key] = AsyncDifyClient(base_url, api_key)
+        return _clients[key]
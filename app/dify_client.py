@@ -0,0 +1,159 @@
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+# ================= Dify HTTP Client =================
+
+# Seconds to establish a connection, and to wait for the next bytes of a response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 180
+
+# Retries after the first attempt, and the exponential backoff between them (seconds)
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+# Pooled keep-alive connections kept per host
+POOL_SIZE = 16
+
+# Statuses meaning the gateway never handed the request to Dify, so even a workflow
+# run can be sent again without running twice
+RETRY_ALWAYS_STATUSES = {429, 502, 503}
+# Statuses after which the request may have been processed; only retried when idempotent
+RETRY_IF_IDEMPOTENT_STATUSES = {500, 504}
+
+
+def _request_not_sent(error: requests.exceptions.RequestException) -> bool:
+    """Return whether a request failed before it reached the server (e.g. while connecting)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], "reason", None)
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+def retry_after(headers) -> float:
+    """Return the delay requested by a Retry-After header in seconds, or None."""
+    value = headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
+
+
+def should_retry_status(status_code: int, idempotent: bool) -> bool:
+    """Return whether a response status is worth retrying (see DifyClient)."""
+    return status_code in RETRY_ALWAYS_STATUSES or (idempotent and status_code in RETRY_IF_IDEMPOTENT_STATUSES)
+
+
+def backoff_delay(attempt: int, base: float, cap: float, requested: float = None) -> float:
+    """
+    Seconds to wait before retry number attempt (0-based): exponential backoff with
+    full jitter, or the delay the server requested, capped at cap.
+    """
+    if requested is not None:
+        return min(requested, cap)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class DifyClient:
+    """
+    Client of the Dify API owning one pooled requests.Session, so calls reuse
+    keep-alive connections instead of a new TCP/TLS handshake each.
+
+    Failed calls are retried with jittered exponential backoff when that is safe:
+    always if the request never reached Dify (connection errors, 429/502/503), and
+    for idempotent requests also when it may have been processed (500/504, read errors).
+    Workflow runs and uploads are not idempotent.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        # Retries are handled by request() so they can take idempotency into account
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, path: str, idempotent: bool = False, **kwargs) -> requests.Response:
+        """
+        Send a request to the Dify API, retrying transient failures (see the class docstring).
+
+        Keyword arguments are passed to requests.Session.request; file objects in
+        "files" are rewound before every attempt.
+
+        Returns:
+            requests.Response: The last response, which may still be an error status.
+
+        Raises:
+            requests.exceptions.RequestException: If the last attempt failed without a response.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            for file in (kwargs.get("files") or {}).values():
+                if isinstance(file, tuple) and hasattr(file[1], "seek"):
+                    file[1].seek(0)
+
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if last_attempt or not (idempotent or _request_not_sent(e)):
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                logging.warning(f"Dify {method} {path} failed ({e}); retrying in {delay:.1f}s.")
+            else:
+                if last_attempt or not should_retry_status(response.status_code, idempotent):
+                    return response
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after(response.headers))
+                logging.warning(f"Dify {method} {path} returned {response.status_code}; retrying in {delay:.1f}s.")
+                response.close()
+            time.sleep(delay)
+
+    def run_workflow(self, data: dict, stream: bool = False) -> requests.Response:
+        """
+        Run the workflow (POST /workflows/run) with the given request body. With stream,
+        the body is read lazily, as needed for response_mode "streaming".
+        """
+        return self.request("POST", "/workflows/run", json=data, stream=stream)
+
+    def stop_task(self, task_id: str, user: str) -> requests.Response:
+        """Stop a running workflow (POST /workflows/tasks/{task_id}/stop); stopping is idempotent."""
+        return self.request("POST", f"/workflows/tasks/{task_id}/stop", idempotent=True, json={"user": user})
+
+    def upload_file(self, file_path: str, file_name: str, mime_type: str, data: dict) -> requests.Response:
+        """Upload a file (POST /files/upload) with the given form fields."""
+        with open(file_path, "rb") as file:
+            return self.request("POST", "/files/upload", files={"file": (file_name, file, mime_type)}, data=data)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str, api_key: str) -> DifyClient:
+    """Return the process-wide DifyClient for a Dify API URL and key, creating it once."""
+    with _clients_lock:
+        key = (base_url, api_key)
+        if key not in _clients:
+            _clients[key] = DifyClient(base_url, api_key)
+        return _clients[key]
@@ -0,0 +1,125 @@
+import json
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+# ================= Dify Call Metrics =================
+# One small record per Dify call (latency, sizes, status, tokens) instead of logging
+# whole payloads. Full payloads are only logged at DEBUG level, for a sample of calls.
+
+# Most recent calls kept for the stats view
+METRICS_WINDOW = 500
+# Share of calls whose full request and response are logged when the log level is DEBUG
+PAYLOAD_SAMPLE_RATE = 0.1
+
+# Statuses of calls that didn't fail: workflow runs report a status (stopped ones were
+# abandoned on purpose), uploads an HTTP code
+OK_STATUSES = {"succeeded", "stopped", "200", "201"}
+
+
+def capture_payloads() -> bool:
+    """Return whether the full payloads of the call about to be made should be logged."""
+    return logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_SAMPLE_RATE
+
+
+def _percentile(values: list, fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class DifyMetrics:
+    """
+    Per-call metrics of the Dify calls of the process, over a window of recent calls.
+    Each recorded call is also logged as one JSON line.
+    """
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        call: str,
+        latency: float,
+        status,
+        request_bytes: int = None,
+        response_bytes: int = None,
+        first_chunk: float = None,
+        total_tokens: int = None,
+        elapsed: float = None,
+    ):
+        """
+        Record a finished call.
+
+        Args:
+            call (str): What was called, e.g. "workflow" or "upload".
+            latency (float): Seconds from sending the request to the end of the response.
+            status: The workflow status ("succeeded", "failed", "stopped") or HTTP status.
+            first_chunk (float): Seconds until the first streamed text, for streaming runs.
+            total_tokens (int), elapsed (float): As reported by Dify for the run.
+        """
+        entry = {
+            "call": call,
+            "at": time.time(),
+            "latency_ms": round(latency * 1000, 1),
+            "status": str(status),
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+            "first_chunk_ms": round(first_chunk * 1000, 1) if first_chunk is not None else None,
+            "total_tokens": total_tokens,
+            "dify_elapsed_s": elapsed,
+        }
+        with self._lock:
+            self._calls.append(entry)
+        logging.info(f"Dify call: {json.dumps(entry)}")
+
+    def recent(self, limit: int = 20) -> list:
+        """Return the most recent calls, newest first."""
+        with self._lock:
+            return list(self._calls)[::-1][:limit]
+
+    def summary(self) -> list:
+        """Return one row of aggregates per kind of call over the window."""
+        with self._lock:
+            calls = list(self._calls)
+
+        rows = []
+        for kind in sorted({entry["call"] for entry in calls}):
+            entries = [entry for entry in calls if entry["call"] == kind]
+            latencies = [entry["latency_ms"] for entry in entries]
+            first_chunks = [entry["first_chunk_ms"] for entry in entries if entry["first_chunk_ms"] is not None]
+            tokens = [entry["total_tokens"] for entry in entries if entry["total_tokens"]]
+            rows.append({
+                "call": kind,
+                "calls": len(entries),
+                "errors": sum(entry["status"] not in OK_STATUSES for entry in entries),
+                "p50_ms": _percentile(latencies, 0.5),
+                "p95_ms": _percentile(latencies, 0.95),
+                "first_chunk_p50_ms": _percentile(first_chunks, 0.5),
+                "request_kb": round(sum(entry["request_bytes"] or 0 for entry in entries) / 1024, 1),
+                "response_kb": round(sum(entry["response_bytes"] or 0 for entry in entries) / 1024, 1),
+                "total_tokens": sum(tokens),
+                "dify_elapsed_s": round(sum(entry["dify_elapsed_s"] or 0 for entry in entries), 2),
+            })
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> DifyMetrics:
+    """Return the process-wide DifyMetrics."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = DifyMetrics()
+        return _metrics
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import requests
 import streamlit as st
 import base64
@@ -9,6 +10,10 @@ from pathlib import Path
 from app import app_utils
 from app.history import ChatHistory
 from app.dify import llm_chat
+from app.dify_client import get_client
+from app.dify_metrics import get_metrics
+from app.dify_admission import get_admission, is_backend_failure, DifyUnavailable, WAITING_MESSAGE
+from app.writer import current_session_key
 from app.app_settings import AppSettings
 
 # Paths for file mappings and markdown storage
@@ -111,26 +116,41 @@ def upload_to_dify(file_path: str, file_name: str):
         dict: The uploaded file metadata.
     """
     
-    url = f"{settings.DIFY_API_URL}/files/upload"
-    remote_api_key = settings.DIFY_API_KEY
-
     # print("file_path", file_path)
     # print("file_name", file_name)
 
-    # Open the file in binary mode for upload
-    with open(file_path, "rb") as file:
-        files = {
-            "file": (file_name, file, "text/markdown"),
-        }
-        data = {
-            "user": "ResearchFlow",
-            "type": "MD",
-        }
-        headers = {
-            "Authorization": f"Bearer {remote_api_key}",
-        }
-        # Make the POST request
-        response = requests.post(url, headers=headers, files=files, data=data)
+    data = {
+        "user": "ResearchFlow",
+        "type": "MD",
+    }
+    # Uploads share the process-wide limit on concurrent Dify calls
+    admission = get_admission()
+    notice = app_utils.WaitNotice(WAITING_MESSAGE)
+    try:
+        probe = admission.acquire(current_session_key(), on_wait=notice)
+    except DifyUnavailable as e:
+        st.error(str(e))
+        return None
+    finally:
+        notice.clear()
+
+    started = time.monotonic()
+    request_bytes = os.path.getsize(file_path)
+    try:
+        # Upload through the pooled, retrying Dify client
+        response = get_client(settings.DIFY_API_URL, settings.DIFY_API_KEY).upload_file(
+            file_path, file_name, "text/markdown", data
+        )
+    except requests.exceptions.RequestException as e:
+        admission.release(False, probe)
+        get_metrics().record("upload", time.monotonic() - started, "error", request_bytes=request_bytes)
+        st.error(f"Error uploading file: {e}")
+        return None
+    admission.release(not is_backend_failure(response.status_code), probe)
+    get_metrics().record(
+        "upload", time.monotonic() - started, response.status_code,
+        request_bytes=request_bytes, response_bytes=len(response.content),
+    )
 
     if response.ok:
         st.success("File uploaded to dify successfully")
@@ -147,6 +167,8 @@ def upload_to_dify(file_path: str, file_name: str):
 
 @st.dialog("Upload File 📎", width="large")
 def upload_file( ):
+    # This module's settings are shared by all sessions; pick up changes saved elsewhere
+    settings.refresh()
     file_mappings = load_file_mappings()
     con = st.container()
     # Chat_session = settings.SELECTED_CHAT
@@ -326,20 +348,25 @@ def upload_file( ):
                                     settings.save()
                                 st.session_state["new_chat"] = False
 
-                            sessions = chat_history.fetch_chat_sessions()
-                            if title and settings.SELECTED_CHAT != title and title not in sessions:
-                                chat_history.change_chat_name(settings.SELECTED_CHAT, title)
-                                settings.SELECTED_CHAT = title
-                                settings.save()
-
-                            chat_history.save_file_info(settings.SELECTED_CHAT,file_name, file_info["id"])
-                            # save_file_mappings(file_mappings)
-
                             dify_query["Query"] = f"Generate a report for : '{title}'"
                             temp_input = json.dumps(dify_query)
 
-                            user_input_id = chat_history.add_user_input(settings.SELECTED_CHAT,  temp_input)
-                            app_utils.print_ai_response(report,  settings.SELECTED_CHAT, chat_history, user_input_id)
+                            # Stream the report before writing so the database isn't locked meanwhile
+                            ai_streamed_response = app_utils.print_ai_response(report)
+
+                            # Save rename, file info and the report turn with a single commit
+                            sessions = chat_history.fetch_chat_sessions()
+                            with chat_history.transaction():
+                                if title and settings.SELECTED_CHAT != title and title not in sessions:
+                                    chat_history.change_chat_name(settings.SELECTED_CHAT, title)
+                                    settings.SELECTED_CHAT = title
+
+                                chat_history.save_file_info(settings.SELECTED_CHAT,file_name, file_info["id"])
+                                # save_file_mappings(file_mappings)
+
+                                user_input_id = chat_history.add_user_input(settings.SELECTED_CHAT,  temp_input)
+                                chat_history.add_ai_response(settings.SELECTED_CHAT, user_input_id, ai_streamed_response)
+                            settings.save()
                             chat_history.load_chat_into_session_state(settings.SELECTED_CHAT)
 
                             con.success(
@@ -1,9 +1,18 @@
 import sqlite3
+import functools
 import streamlit as st
+from app.db import CHAT_HISTORY_DB, get_connection, content_hash, transaction, after_commit, store_content
+from app.cache import RevisionCache
+from app.writer import get_writer, current_session_key
+import app.writer as background
+import app.migrations as migrations
+from app.truncate import MAX_CONTEXT_SIZE
 import logging
 from logging.handlers import RotatingFileHandler
 # import app.state_manager as state_manager
 import json
+import re
+import itertools
 
 # Configure logging
 log_file = "app.log"
@@ -17,379 +26,851 @@ for h in logger.handlers[:]:
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 
+# Number of turns (user input plus latest AI response) loaded per page of a chat
+HISTORY_PAGE_SIZE = 20
+# Sessions listed per page of the sidebar
+SESSION_PAGE_SIZE = 50
+# Largest SQLite rowid, used as the keyset cursor for the newest page
+MAX_ROW_ID = 2**63 - 1
+# Titles bound per DELETE statement when deleting many sessions
+DELETE_BATCH_SIZE = 500
+# Archive records inserted per transaction by ChatHistory.import_jsonl
+IMPORT_BATCH_SIZE = 5000
+
+# Process-wide cache of chat reads shared by every ChatHistory and Streamlit session.
+# Reruns that only change the UI are served from here without touching SQLite.
+history_cache = RevisionCache(max_entries=256)
+
+# One page of a conversation: every user input with its latest AI response and the
+# number of response versions (see ChatHistory.fetch_conversation)
+FETCH_CONVERSATION_QUERY = """
+    WITH page AS (
+        SELECT ui.id, ui.content
+        FROM user_inputs ui
+        INNER JOIN chat_sessions cs ON ui.session_id = cs.id
+        WHERE cs.title = ? AND ui.id < ?
+        ORDER BY ui.id DESC
+        LIMIT ?
+    )
+    SELECT user_input_id, user_input, role,
+           CASE WHEN blob_hash IS NULL THEN message ELSE inflate(cb.encoding, cb.data) END,
+           version, edited_code, max_version
+    FROM (
+        SELECT page.id AS user_input_id,
+               page.content AS user_input,
+               cm.role,
+               cm.content AS message,
+               cm.blob_hash,
+               cm.version,
+               cm.edited_code,
+               COUNT(cm.id) OVER (PARTITION BY page.id) AS max_version,
+               ROW_NUMBER() OVER (PARTITION BY page.id ORDER BY cm.version DESC) AS version_rank
+        FROM page
+        LEFT JOIN chat_messages cm ON page.id = cm.user_input_id
+    ) latest
+    -- Only the latest version of each response is decompressed
+    LEFT JOIN content_blobs cb ON cb.hash = latest.blob_hash
+    WHERE version_rank = 1
+    ORDER BY user_input_id
+"""
+
+
+def set_async_writes(enabled: bool, db_path: str = CHAT_HISTORY_DB):
+    """
+    Turn background persistence of chat history writes on or off for the whole process.
+
+    When on, ChatHistory writes are queued for a single writer thread instead of taking
+    the SQLite write lock in the Streamlit script thread (see ChatHistory.run_write).
+    Turning it off flushes the queue first.
+    """
+    background.set_async_writes(db_path, enabled)
+
+
+def _write(wait=False):
+    """
+    Decorator for ChatHistory write methods, routing them through run_write.
+    With wait=False the call returns None right away in background mode.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return self.run_write(lambda: method(self, *args, **kwargs), wait)
+        return wrapper
+    return decorator
+
 
 class ChatHistory:
-    def __init__(self):
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_path: str = CHAT_HISTORY_DB):
+        self.db_path = db_path
 
-        # Create chat_sessions table with a timestamp column
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT UNIQUE NOT NULL,
-                file_name TEXT,   -- Added column for the uploaded file name
-                file_id TEXT,     -- Added column for the uploaded file id
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        # Create or upgrade the tables; this only touches the database on the
+        # first ChatHistory of the process.
+        migrations.ensure_schema(self.db_path)
 
-        # Create user_inputs table
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_inputs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions (id)
-            )
-        """)
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Borrow this thread's pooled connection to the chat history database.
+        """
+        return get_connection(self.db_path)
 
-        # Create chat_messages table
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL,
-                user_input_id INTEGER,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                version INTEGER DEFAULT 1,
-                edited_code TEXT,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions (id),
-                FOREIGN KEY (user_input_id) REFERENCES user_inputs (id)
-            )
-        """)
+    def transaction(self):
+        """
+        Group several writes into one unit of work with a single commit, e.g. a whole turn:
+
+            with history.transaction():
+                user_input_id = history.add_user_input(title, user_input)
+                history.add_ai_response(title, user_input_id, response)
+
+        Nested transactions (every write method opens one) become savepoints.
+        Everything is rolled back if the block raises.
+
+        With background writes on, the session's queued writes are applied first and the
+        block then writes directly on this thread; prefer run_write to stay off the lock.
+        """
+        self._sync()
+        return transaction(self.db_path)
+
+    def run_write(self, write, wait=False):
+        """
+        Run write() as one unit of work (a transaction) and return its result.
+
+        With background writes on (see set_async_writes), write() is queued for the writer
+        thread instead, in submission order. The call then only blocks when wait is True,
+        returning write()'s result or re-raising its error; otherwise it returns None and
+        failures are logged. Inside an open transaction() write() always runs right away.
+        """
+        writer = get_writer(self.db_path)
+        if writer is None or writer.is_writer_thread() or self._connect().in_transaction:
+            with transaction(self.db_path):
+                return write()
 
-        self.conn.commit()
-        self.conn.close()
+        future = writer.submit(current_session_key(), write)
+        return future.result() if wait else None
+
+    def _sync(self):
+        """
+        Read-your-writes: wait until the calling session's queued writes are committed.
+        """
+        writer = get_writer(self.db_path)
+        if writer is not None and not writer.is_writer_thread():
+            writer.wait_for(current_session_key())
+
+    def _get_session_id(self, cursor, session_title):
+        """Return the ID of the session with the given title or raise ValueError."""
+        cursor.execute("SELECT id FROM chat_sessions WHERE title = ?", (session_title,))
+        session = cursor.fetchone()
+        if not session:
+            raise ValueError(f"Session with title '{session_title}' not found.")
+        return session[0]
+
+    def _get_session_title(self, cursor, user_input_id):
+        """Return the title of the session a user input belongs to, or None."""
+        cursor.execute("""
+            SELECT cs.title FROM user_inputs ui
+            INNER JOIN chat_sessions cs ON ui.session_id = cs.id
+            WHERE ui.id = ?
+        """, (user_input_id,))
+        session = cursor.fetchone()
+        return session[0] if session else None
+
+    # ================= Read Cache =================
+    # Cache scopes: the session list, one scope per session title and one per user
+    # input's AI responses. Every write invalidates the scopes it touches once its
+    # transaction commits.
+
+    def _sessions_scope(self):
+        return (self.db_path, "sessions")
+
+    def _session_scope(self, session_title):
+        return (self.db_path, "session", session_title)
+
+    def _responses_scope(self, user_input_id):
+        return (self.db_path, "responses", user_input_id)
+
+    def _cached(self, scope, key, loader):
+        """Return loader() through history_cache."""
+        self._sync()
+        if self._connect().in_transaction:
+            # Uncommitted writes of this thread must be visible and must not be cached
+            return loader()
+        return history_cache.get_or_load(scope, key, loader)
+
+    def _invalidate(self, *scopes):
+        """Invalidate the given cache scopes once the current transaction commits."""
+        after_commit(lambda: history_cache.invalidate(*scopes), self.db_path)
 
     def fetch_chat_sessions(self):
         """
         Fetch all chat sessions ordered by timestamp (newest first).
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            SELECT title FROM chat_sessions 
-            ORDER BY timestamp DESC
-        """)
-        sessions = [row[0] for row in self.cursor.fetchall()]
-        self.conn.close()
-        return sessions
+        def load():
+            cursor = self._connect().cursor()
+            cursor.execute("""
+                SELECT title FROM chat_sessions 
+                ORDER BY timestamp DESC, id DESC
+            """)
+            return tuple(row[0] for row in cursor.fetchall())
+
+        return list(self._cached(self._sessions_scope(), "fetch_chat_sessions", load))
+
+    def fetch_chat_session_page(self, limit=SESSION_PAGE_SIZE, cursor=None):
+        """
+        Fetch one page of chat sessions, most recently active first, using keyset pagination
+        over the (timestamp, id) index.
+
+        Args:
+            limit (int): Maximum number of sessions.
+            cursor (tuple): The cursor returned with the previous page, or None for the first page.
+
+        Returns:
+            tuple: (sessions, cursor). sessions are dicts with "id", "title" and "last_activity";
+            cursor is passed to fetch the next page, or None when there are no more sessions.
+        """
+        def load():
+            db_cursor = self._connect().cursor()
+            if cursor is None:
+                db_cursor.execute("""
+                    SELECT id, title, timestamp FROM chat_sessions
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                """, (limit + 1,))
+            else:
+                db_cursor.execute("""
+                    SELECT id, title, timestamp FROM chat_sessions
+                    WHERE (timestamp, id) < (?, ?)
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                """, (*cursor, limit + 1))
+            return tuple(db_cursor.fetchall())
+
+        key = ("fetch_chat_session_page", limit, tuple(cursor) if cursor is not None else None)
+        rows = self._cached(self._sessions_scope(), key, load)
+
+        next_cursor = None
+        if len(rows) > limit:
+            # One row more than requested means more sessions exist
+            rows = rows[:limit]
+            next_cursor = (rows[-1][2], rows[-1][0])
+        sessions = [{"id": id, "title": title, "last_activity": timestamp} for id, title, timestamp in rows]
+        return sessions, next_cursor
+
+    def chat_session_exists(self, title):
+        """
+        Return whether a chat session with the given title exists.
+        """
+        def load():
+            cursor = self._connect().cursor()
+            cursor.execute("SELECT 1 FROM chat_sessions WHERE title = ?", (title,))
+            return cursor.fetchone() is not None
+
+        return self._cached(self._session_scope(title), "chat_session_exists", load)
 
     def create_chat_session(self, title):
+        def write():
+            with transaction(self.db_path) as conn:
+                conn.execute("INSERT INTO chat_sessions (title) VALUES (?)", (title,))
+                self._invalidate(self._sessions_scope(), self._session_scope(title))
+
         try:
-            self.conn = sqlite3.connect("app/data/chat_history.db")
-            self.cursor = self.conn.cursor()
-            self.cursor.execute("INSERT INTO chat_sessions (title) VALUES (?)", (title,))
-            self.conn.commit()
+            self.run_write(write, wait=True)
             logging.info(f"Chat session '{title}' created successfully!")
         except sqlite3.IntegrityError:
             st.error(f"Chat session '{title}' already exists!")
-        finally:
-            self.conn.close()
 
     def delete_chat_session(self, title):
         try:
-            self.conn = sqlite3.connect("app/data/chat_history.db")
-            self.cursor = self.conn.cursor()
-            self.cursor.execute("SELECT id FROM chat_sessions WHERE title = ?", (title,))
-            session = self.cursor.fetchone()
-            if session:
-                session_id = session[0]
-                self.cursor.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
-                self.cursor.execute("DELETE FROM user_inputs WHERE session_id = ?", (session_id,))
-                self.cursor.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
-                self.conn.commit()
+            deleted = self.delete_chat_sessions([title])
+            if deleted:
                 st.success(f"Chat session '{title}' and its messages deleted successfully!")
             else:
                 st.warning(f"Chat session '{title}' not found!")
         except Exception as e:
             st.error(f"Error deleting chat session: {e}")
-        finally:
-            self.conn.close()
 
+    @_write(wait=True)
+    def delete_chat_sessions(self, titles):
+        """
+        Delete many chat sessions in one transaction. Their user inputs and AI responses
+        are removed by ON DELETE CASCADE; the freed space is reclaimed by the background
+        incremental vacuum.
+
+        Returns:
+            int: The number of sessions deleted.
+        """
+        titles = list(titles)
+        deleted = 0
+        with self.transaction() as conn:
+            for start in range(0, len(titles), DELETE_BATCH_SIZE):
+                batch = titles[start:start + DELETE_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                cursor = conn.execute(f"DELETE FROM chat_sessions WHERE title IN ({placeholders})", batch)
+                deleted += cursor.rowcount
+            self._invalidate(self._sessions_scope(), *(self._session_scope(title) for title in titles))
+        logging.info(f"Deleted {deleted} chat session(s).")
+        return deleted
+
+    @_write(wait=True)
     def add_user_input(self, session_title, content):
         """
         Add a user input to the user_inputs table and update the session's timestamp.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-
-        # Get the session ID
-        self.cursor.execute("SELECT id FROM chat_sessions WHERE title = ?", (session_title,))
-        session = self.cursor.fetchone()
-        if not session:
-            raise ValueError(f"Session with title '{session_title}' not found.")
-        session_id = session[0]
-
-        # Insert user input
-        self.cursor.execute(
-            "INSERT INTO user_inputs (session_id, content) VALUES (?, ?)",
-            (session_id, content)
-        )
-
-        # Update the timestamp for the session
-        self.cursor.execute(
-            "UPDATE chat_sessions SET timestamp = CURRENT_TIMESTAMP WHERE id = ?",
-            (session_id,)
-        )
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            session_id = self._get_session_id(cursor, session_title)
+
+            # Insert user input
+            cursor.execute(
+                "INSERT INTO user_inputs (session_id, content, content_hash) VALUES (?, ?, ?)",
+                (session_id, content, content_hash(content))
+            )
+            user_input_id = cursor.lastrowid
 
-        self.conn.commit()
-        user_input_id = self.cursor.lastrowid
-        self.conn.close()
+            # Update the timestamp for the session
+            cursor.execute(
+                "UPDATE chat_sessions SET timestamp = CURRENT_TIMESTAMP WHERE id = ?",
+                (session_id,)
+            )
+            self._invalidate(self._sessions_scope(), self._session_scope(session_title))
         return user_input_id
     
     def get_user_input_id(self, session_title, content):
         """
         Get the user input ID for a specific user input content.
+        If the same input was sent more than once, the most recent one is returned.
+
+        Prefer the "user_input_id" carried by the loaded messages; this lookup is only
+        needed when the ID is unknown.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
+        self._sync()
+        self.conn = self._connect()
         self.cursor = self.conn.cursor()
+        session_id = self._get_session_id(self.cursor, session_title)
 
-        # Get the session ID
-        self.cursor.execute("SELECT id FROM chat_sessions WHERE title = ?", (session_title,))
-        session = self.cursor.fetchone()
-        if not session:
-            raise ValueError(f"Session with title '{session_title}' not found.")
-        session_id = session[0]
-
-        # Get the user input ID
+        # Get the user input ID through the (session_id, content_hash) index
         self.cursor.execute(
-            "SELECT id FROM user_inputs WHERE session_id = ? AND content = ?",
-            (session_id, content)
+            """
+            SELECT id FROM user_inputs
+            WHERE session_id = ? AND content_hash = ? AND content = ?
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            (session_id, content_hash(content), content)
         )
         user_input = self.cursor.fetchone()
         if not user_input:
             raise ValueError(f"User input with content '{content}' not found.")
         user_input_id = user_input[0]
-        self.conn.close()
         return user_input_id
 
+    @_write(wait=False)
     def add_ai_response(self, session_title, user_input_id, content, version=1):
         """
         Add an AI response linked to a specific user input.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            session_id = self._get_session_id(cursor, session_title)
+
+            # Insert AI response; large responses go to content_blobs
+            stored_content, blob_hash = store_content(cursor, content)
+            cursor.execute(
+                "INSERT INTO chat_messages (session_id, user_input_id, role, content, blob_hash, version, edited_code) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, user_input_id, "ai", stored_content, blob_hash, version, "")
+            )
+            self._invalidate(self._session_scope(session_title), self._responses_scope(user_input_id))
+    
+    @_write(wait=True)
+    def add_turns(self, session_title, turns):
+        """
+        Bulk insert whole turns into a chat session in one transaction, e.g. when importing
+        conversations. AI responses of all turns are written with a single executemany.
 
-        # Get the session ID
-        self.cursor.execute("SELECT id FROM chat_sessions WHERE title = ?", (session_title,))
-        session = self.cursor.fetchone()
-        if not session:
-            raise ValueError(f"Session with title '{session_title}' not found.")
-        session_id = session[0]
+        Args:
+            session_title (str): The chat session title.
+            turns (iterable): (user_input, responses) pairs, where user_input is the stored
+                JSON string and responses lists the AI response versions, oldest first.
 
-        # Insert AI response
-        self.cursor.execute(
-            "INSERT INTO chat_messages (session_id, user_input_id, role, content, version, edited_code) VALUES (?, ?, ?, ?, ?, ?)",
-            (session_id, user_input_id, "ai", content, version, "")
-        )
-        self.conn.commit()
-        self.conn.close()
-    
+        Returns:
+            list: The IDs of the inserted user inputs.
+        """
+        user_input_ids = []
+        ai_rows = []
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            session_id = self._get_session_id(cursor, session_title)
+
+            for content, responses in turns:
+                cursor.execute(
+                    "INSERT INTO user_inputs (session_id, content, content_hash) VALUES (?, ?, ?)",
+                    (session_id, content, content_hash(content))
+                )
+                user_input_id = cursor.lastrowid
+                user_input_ids.append(user_input_id)
+                ai_rows.extend(
+                    (session_id, user_input_id, "ai", *store_content(cursor, response), version, "")
+                    for version, response in enumerate(responses, start=1)
+                )
+
+            cursor.executemany(
+                "INSERT INTO chat_messages (session_id, user_input_id, role, content, blob_hash, version, edited_code) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ai_rows
+            )
+            cursor.execute(
+                "UPDATE chat_sessions SET timestamp = CURRENT_TIMESTAMP WHERE id = ?",
+                (session_id,)
+            )
+            self._invalidate(self._sessions_scope(), self._session_scope(session_title))
+        return user_input_ids
+
+    @_write(wait=False)
     def update_user_input(self, user_input_id, content):
         """
         Update the content of a user input.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("UPDATE user_inputs SET content = ? WHERE id = ?", (content, user_input_id))
-        self.conn.commit()
-        self.conn.close()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE user_inputs SET content = ?, content_hash = ? WHERE id = ?",
+                (content, content_hash(content), user_input_id)
+            )
+            self._invalidate(self._session_scope(self._get_session_title(conn.cursor(), user_input_id)))
 
     def get_ai_responses(self, user_input_id):
         """
         Retrieve all AI responses for a specific user input, ordered by version.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            SELECT content, version FROM chat_messages
-            WHERE user_input_id = ?
-            ORDER BY version ASC
-        """, (user_input_id,))
-        responses = self.cursor.fetchall()
-        self.conn.close()
-        return responses
+        def load():
+            cursor = self._connect().cursor()
+            cursor.execute("""
+                SELECT CASE WHEN cm.blob_hash IS NULL THEN cm.content ELSE inflate(cb.encoding, cb.data) END,
+                       cm.version
+                FROM chat_messages cm
+                LEFT JOIN content_blobs cb ON cb.hash = cm.blob_hash
+                WHERE cm.user_input_id = ?
+                ORDER BY cm.version ASC
+            """, (user_input_id,))
+            return tuple(cursor.fetchall())
+
+        return list(self._cached(self._responses_scope(user_input_id), "get_ai_responses", load))
     
+    @_write(wait=False)
     def update_ai_response(self, user_input_id, version, content):
         """
         Update the content of an AI response.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("UPDATE chat_messages SET content = ? WHERE user_input_id = ? AND version = ?", (content, user_input_id, version))
-        self.conn.commit()
-        self.conn.close()
+        with self.transaction() as conn:
+            stored_content, blob_hash = store_content(conn.cursor(), content)
+            conn.execute(
+                "UPDATE chat_messages SET content = ?, blob_hash = ? WHERE user_input_id = ? AND version = ?",
+                (stored_content, blob_hash, user_input_id, version)
+            )
+            self._invalidate(
+                self._session_scope(self._get_session_title(conn.cursor(), user_input_id)),
+                self._responses_scope(user_input_id),
+            )
     
+    @_write(wait=False)
     def update_ai_response_code(self, user_input_id, version, edited_code):
         """
         Update the content of an AI response.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("UPDATE chat_messages SET edited_code = ? WHERE user_input_id = ? AND version = ?", (edited_code, user_input_id, version))
-        self.conn.commit()
-        self.conn.close()
+        with self.transaction() as conn:
+            conn.execute("UPDATE chat_messages SET edited_code = ? WHERE user_input_id = ? AND version = ?", (edited_code, user_input_id, version))
+            self._invalidate(self._session_scope(self._get_session_title(conn.cursor(), user_input_id)))
 
     def fetch_chat_messages(self, session_title):
         """
         Fetch all messages for a given chat session.
         """
-        self.conn = sqlite3.connect("app/data/chat_history.db")
+        self._sync()
+        self.conn = self._connect()
         self.cursor = self.conn.cursor()
         self.cursor.execute("""
-            SELECT ui.content AS user_input, cm.role, cm.content AS message, cm.version, cm.edited_code 
+            SELECT ui.content AS user_input, cm.role,
+                   CASE WHEN cm.blob_hash IS NULL THEN cm.content ELSE inflate(cb.encoding, cb.data) END AS message,
+                   cm.version, cm.edited_code 
             FROM user_inputs ui
             LEFT JOIN chat_messages cm ON ui.id = cm.user_input_id
+            LEFT JOIN content_blobs cb ON cb.hash = cm.blob_hash
             INNER JOIN chat_sessions cs ON ui.session_id = cs.id
             WHERE cs.title = ?
             ORDER BY ui.id, cm.version ASC
         """, (session_title,))
         messages = self.cursor.fetchall()
-        self.conn.close()
         return messages
 
-    def load_chat_into_session_state(self, selected_chat):
-        
-        st.session_state["messages"] = []
-
-        messages = self.fetch_chat_messages(selected_chat)
-        user = ""
-        for user_input, role, message, version, edited_code in messages:
-            user_input_id = self.get_user_input_id(selected_chat, user_input)
-            ai_responses = self.get_ai_responses(user_input_id)
-            max_version = len(ai_responses)
-            if user_input != user:
-                user_in = json.loads(user_input)
-                st.session_state["messages"].append({
-                    "role": "user",
-                    "content": user_in["Query"],
-                    # "web_search": user_in["WebSearch"],
-                    # "advanced_search": user_in["AdvanceSearch"],
-                    "version": 1,
-                    "user_input_id": user_input_id,
-                })
-                user = user_input
-            
-            if role == "ai" and version == max_version:
-                if edited_code != "":
+    def fetch_conversation(self, session_title, limit=None, before_id=None):
+        """
+        Fetch the user inputs of a chat session together with their latest AI response
+        and the number of response versions, in a single query.
+
+        Args:
+            session_title (str): The chat session title.
+            limit (int): Only fetch the `limit` most recent user inputs. None fetches all.
+            before_id (int): Keyset cursor; only fetch user inputs with an ID below it.
+
+        Returns rows of (user_input_id, user_input, role, message, version, edited_code, max_version),
+        oldest first. role, message, version and edited_code are None for user inputs without a response.
+        """
+        def load():
+            cursor = self._connect().cursor()
+            cursor.execute(FETCH_CONVERSATION_QUERY, (
+                session_title,
+                before_id if before_id is not None else MAX_ROW_ID,
+                limit if limit is not None else -1,  # A negative LIMIT means no limit
+            ))
+            return tuple(cursor.fetchall())
+
+        key = ("fetch_conversation", limit, before_id)
+        return list(self._cached(self._session_scope(session_title), key, load))
+
+    def _build_messages(self, rows):
+        """
+        Turn fetch_conversation rows into the message dicts consumed by app_utils.display_messages.
+
+        Each AI message carries its user_input_id and max_version (the number of stored
+        versions), so displaying the chat needs no further queries.
+        """
+        messages = []
+        for user_input_id, user_input, role, message, version, edited_code, max_version in rows:
+            user_in = json.loads(user_input)
+            messages.append({
+                "role": "user",
+                "content": user_in["Query"],
+                # "web_search": user_in["WebSearch"],
+                # "advanced_search": user_in["AdvanceSearch"],
+                "version": 1,
+                "user_input_id": user_input_id,
+            })
+
+            if role == "ai":
+                if edited_code:
                     message = f"{message}\n\n <strong>Edited Code:<strong> \n {edited_code}"
-                st.session_state["messages"].append({
+                messages.append({
                         "user_input_id": user_input_id,
                         "user_input": user_input,
                         "role": role,
                         "content": message,
                         "version": version,
+                        "max_version": max_version,
                         # "show_code_editor": False,
                         # "edited_code": edited_code,
-                        
                     })
-    
-    def load_chat_history(self, selected_chat):
-        
-        msg = []
+        return messages
+
+    def load_conversation(self, selected_chat, limit=None, before_id=None):
+        """
+        Build the message list consumed by app_utils.display_messages for a chat session.
+        """
+        return self._build_messages(self.fetch_conversation(selected_chat, limit, before_id))
+
+    def load_conversation_page(self, selected_chat, limit=HISTORY_PAGE_SIZE, before_id=None):
+        """
+        Load one page of a chat session, newest turns first, using keyset pagination.
+
+        Returns:
+            tuple: (messages, cursor). cursor is the before_id for the next (older) page,
+            or None when there are no older turns.
+        """
+        rows = self.fetch_conversation(selected_chat, limit + 1, before_id)
+        cursor = None
+        if len(rows) > limit:
+            # One row more than requested means older turns exist
+            rows = rows[1:]
+            cursor = rows[0][0]
+        return self._build_messages(rows), cursor
+
+    def load_chat_into_session_state(self, selected_chat, keep_loaded=False):
+        """
+        Load the most recent page of a chat session into st.session_state["messages"].
+
+        With keep_loaded, as many turns as are currently loaded are reloaded instead, so
+        the earlier pages the user loaded stay on screen (e.g. after regenerating a response).
+        """
+        limit = HISTORY_PAGE_SIZE
+        if keep_loaded:
+            limit = max(limit, st.session_state.get("history_turns", 0))
+        messages, cursor = self.load_conversation_page(selected_chat, limit)
+        st.session_state["messages"] = messages
+        st.session_state["history_cursor"] = cursor
+        st.session_state["history_turns"] = sum(message["role"] == "user" for message in messages)
+
+    def load_earlier_messages(self, selected_chat):
+        """
+        Prepend the next older page of a chat session to st.session_state["messages"].
+        """
+        before_id = st.session_state.get("history_cursor")
+        if before_id is None:
+            return
+
+        messages, cursor = self.load_conversation_page(selected_chat, before_id=before_id)
+        st.session_state["messages"] = messages + st.session_state["messages"]
+        st.session_state["history_cursor"] = cursor
+        st.session_state["history_turns"] = st.session_state.get("history_turns", 0) + sum(
+            message["role"] == "user" for message in messages
+        )
 
-        messages = self.fetch_chat_messages(selected_chat)
-        user = ""
-        for user_input, role, message, version, edited_code in messages:
-            user_input_id = self.get_user_input_id(selected_chat, user_input)
-            ai_responses = self.get_ai_responses(user_input_id)
-            max_version = len(ai_responses)
-            if user_input != user:
+    def load_chat_history(self, selected_chat, max_size=MAX_CONTEXT_SIZE):
+        """
+        Return the most recent turns of a chat session as plain role/content messages
+        for the LLM context, oldest first. The context is truncated to MAX_CONTEXT_SIZE
+        characters before it is sent (see truncate.trancate), so pages of turns are
+        fetched, newest first, only until they fill max_size characters.
+        """
+        msg = []
+        size = 0
+        before_id = None
+        while size < max_size:
+            rows = self.fetch_conversation(selected_chat, HISTORY_PAGE_SIZE, before_id)
+            page = []
+            for user_input_id, user_input, role, message, version, edited_code, max_version in rows:
                 user_in = json.loads(user_input)
-                msg.append({
+                page.append({
                     "role": "user",
                     "content": user_in["Query"],
                 })
-                user = user_input
-            
-            if role == "ai" and version == max_version:
-                msg.append({
-                        "role": role,
-                        "content": message,
-                    })
+
+                if role == "ai":
+                    page.append({
+                            "role": role,
+                            "content": message,
+                        })
+            msg = page + msg
+            # Measured like truncate.trancate does
+            size += sum(len(json.dumps(message)) for message in page)
+            if len(rows) < HISTORY_PAGE_SIZE:
+                break
+            before_id = rows[0][0]
         return msg
-    
+
+    def search(self, query, limit=20):
+        """
+        Full-text search over user queries and AI responses of all chat sessions.
+
+        Args:
+            query (str): Free text; every word must match (the last one as a prefix).
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Best matches first, as dicts with the session "title", "user_input_id",
+            "role" ("user" or "ai") and a "snippet" with the matches in **bold**.
+        """
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        # Quote every word so FTS5 operators in the input are taken literally
+        match = " ".join(f'"{word}"' for word in words) + "*"
+
+        self._sync()
+        cursor = self._connect().cursor()
+        cursor.execute("""
+            SELECT title, user_input_id, role, snippet
+            FROM (
+                SELECT cs.title, ui.id AS user_input_id, 'user' AS role,
+                       snippet(user_inputs_fts, 0, '**', '**', '…', 12) AS snippet,
+                       bm25(user_inputs_fts) AS rank
+                FROM user_inputs_fts
+                INNER JOIN user_inputs ui ON ui.id = user_inputs_fts.rowid
+                INNER JOIN chat_sessions cs ON cs.id = ui.session_id
+                WHERE user_inputs_fts MATCH ?
+                UNION ALL
+                SELECT cs.title, cm.user_input_id, cm.role,
+                       snippet(chat_messages_fts, 0, '**', '**', '…', 12) AS snippet,
+                       bm25(chat_messages_fts) AS rank
+                FROM chat_messages_fts
+                INNER JOIN chat_messages cm ON cm.id = chat_messages_fts.rowid
+                INNER JOIN chat_sessions cs ON cs.id = cm.session_id
+                WHERE chat_messages_fts MATCH ?
+            )
+            ORDER BY rank
+            LIMIT ?
+        """, (match, match, limit))
+        return [
+            {"title": title, "user_input_id": user_input_id, "role": role, "snippet": snippet}
+            for title, user_input_id, role, snippet in cursor.fetchall()
+        ]
+
+    @_write(wait=True)
     def change_chat_name(self, old_name, new_name):
-        self.conn = sqlite3.connect("app/data/chat_history.db")
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("UPDATE chat_sessions SET title = ? WHERE title = ?", (new_name, old_name))
-        self.conn.commit()
-        self.conn.close()
+        with self.transaction() as conn:
+            conn.execute("UPDATE chat_sessions SET title = ? WHERE title = ?", (new_name, old_name))
+            self._invalidate(self._sessions_scope(), self._session_scope(old_name), self._session_scope(new_name))
         logging.info(f"Chat session '{old_name}' renamed to '{new_name}'.")
     
+    @_write(wait=False)
     def save_file_info(self, session_title: str, file_name: str, file_id: str):
         """
         Save the file name and file ID for a chat session identified by session_title.
         If the session exists, update its file_name and file_id columns.
         """
-        db_path: str = "app/data/chat_history.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
         query = """
             UPDATE chat_sessions 
             SET file_name = ?, file_id = ? 
             WHERE title = ?
         """
-        cursor.execute(query, (file_name, file_id, session_title))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute(query, (file_name, file_id, session_title))
+            self._invalidate(self._session_scope(session_title))
 
     def load_file_info(self, session_title: str, ):
         """
         Load and return the file name and file ID for the chat session identified by session_title.
         Returns a tuple (file_name, file_id), or (None, None) if the session is not found.
         """
-        db_path: str = "app/data/chat_history.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT file_name, file_id 
-            FROM chat_sessions 
-            WHERE title = ?
-        """
-        cursor.execute(query, (session_title,))
-        result = cursor.fetchone()
-        conn.close()
-        
+        def load():
+            cursor = self._connect().cursor()
+            query = """
+                SELECT file_name, file_id 
+                FROM chat_sessions 
+                WHERE title = ?
+            """
+            cursor.execute(query, (session_title,))
+            return cursor.fetchone()
+
+        result = self._cached(self._session_scope(session_title), "load_file_info", load)
         if result:
             return {"file_name": result[0], "file_id": result[1]}
         else:
             return {}
-            
-        
-
-    
 
+    # ================= Archive =================
+    # A JSONL archive holds one record per line, grouped by session, oldest first:
+    #   {"type": "session", "title", "file_name", "file_id", "timestamp"}
+    #   {"type": "user_input", "id", "session", "content"}
+    #   {"type": "ai_response", "user_input_id", "version", "content", "edited_code"}
+    # where ai_response.user_input_id refers to the "id" of a user_input of the same session.
 
-# 
-#import sqlite3
-
-# def update_database_schema():
-#         conn = sqlite3.connect("app/data/chat_history.db")
-#         cursor = conn.cursor()
+    def _export_records(self):
+        """
+        Generate the archive records of every chat session one at a time, straight
+        from a single ordered query, so exporting needs constant memory.
+        """
+        self._sync()
+        cursor = self._connect().cursor()
+        cursor.execute("""
+            SELECT cs.id, cs.title, cs.file_name, cs.file_id, cs.timestamp,
+                   ui.id, ui.content,
+                   cm.version,
+                   CASE WHEN cm.blob_hash IS NULL THEN cm.content ELSE inflate(cb.encoding, cb.data) END,
+                   cm.edited_code
+            FROM chat_sessions cs
+            LEFT JOIN user_inputs ui ON ui.session_id = cs.id
+            LEFT JOIN chat_messages cm ON cm.user_input_id = ui.id
+            LEFT JOIN content_blobs cb ON cb.hash = cm.blob_hash
+            ORDER BY cs.id, ui.id, cm.version
+        """)
 
-#         # Add a 'version' column to 'chat_messages' if it doesn't exist
-#         cursor.execute("""
-#         PRAGMA table_info(chat_messages)
-#         """)
-#         columns = [col[1] for col in cursor.fetchall()]
+        session_id = user_input_id = None
+        for row in cursor:
+            if row[0] != session_id:
+                session_id = row[0]
+                yield {"type": "session", "title": row[1], "file_name": row[2], "file_id": row[3], "timestamp": row[4]}
+            if row[5] is not None and row[5] != user_input_id:
+                user_input_id = row[5]
+                yield {"type": "user_input", "id": user_input_id, "session": row[1], "content": row[6]}
+            if row[7] is not None:
+                yield {"type": "ai_response", "user_input_id": user_input_id, "version": row[7], "content": row[8], "edited_code": row[9]}
+
+    def export_jsonl(self, path):
+        """
+        Write every chat session with its user inputs and versioned AI responses to a JSONL archive.
 
-#         if "version" not in columns:
-#             cursor.execute("""
-#             ALTER TABLE chat_messages ADD COLUMN version INTEGER DEFAULT 1
-#             """)
-#             print("Added 'version' column to 'chat_messages'.")
-#         else:
-#             print("'version' column already exists in 'chat_messages'.")
+        Returns:
+            int: The number of records written.
+        """
+        count = 0
+        with open(path, "w", encoding="utf-8") as file:
+            for record in self._export_records():
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        logging.info(f"Exported {count} chat history records to '{path}'.")
+        return count
+
+    @staticmethod
+    def _read_records(path):
+        """Generate the records of a JSONL archive one line at a time."""
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def import_jsonl(self, path, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Import a JSONL archive written by export_jsonl, committing batch_size records per
+        transaction. Sessions whose title already exists are skipped with their records,
+        so restoring the same archive twice doesn't duplicate anything. If the import
+        fails, the batches committed before the failing one are kept (and are the ones
+        counted).
+
+        Returns:
+            dict: The number of imported "sessions", "user_inputs" and "ai_responses",
+            and of "skipped" records.
+        """
+        counts = {"sessions": 0, "user_inputs": 0, "ai_responses": 0, "skipped": 0}
+        session_id = None  # Session being imported, None while skipping an existing one
+        session_title = None
+        user_input_ids = {}  # Archive ID -> new ID of the user inputs of that session
 
-#         conn.commit()
-#         conn.close()
-    
+        records = self._read_records(path)
+        try:
+            while batch := list(itertools.islice(records, batch_size)):
+                # The session being imported may continue from the previous batch
+                titles = [session_title] if session_id is not None else []
+                ai_rows = []
+                # Only added to counts once the batch committed
+                batch_counts = dict.fromkeys(counts, 0)
+                with self.transaction() as conn:
+                    cursor = conn.cursor()
+                    for record in batch:
+                        kind = record.get("type")
+                        if kind == "session":
+                            cursor.execute("""
+                                INSERT INTO chat_sessions (title, file_name, file_id, timestamp)
+                                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                                ON CONFLICT (title) DO NOTHING
+                            """, (record["title"], record.get("file_name"), record.get("file_id"), record.get("timestamp")))
+                            user_input_ids = {}
+                            if cursor.rowcount:
+                                session_id = cursor.lastrowid
+                                session_title = record["title"]
+                                titles.append(session_title)
+                                batch_counts["sessions"] += 1
+                            else:
+                                session_id = None
+                                batch_counts["skipped"] += 1
+                        elif kind == "user_input":
+                            if session_id is None:
+                                batch_counts["skipped"] += 1
+                                continue
+                            content = record["content"]
+                            cursor.execute(
+                                "INSERT INTO user_inputs (session_id, content, content_hash) VALUES (?, ?, ?)",
+                                (session_id, content, content_hash(content))
+                            )
+                            user_input_ids[record["id"]] = cursor.lastrowid
+                            batch_counts["user_inputs"] += 1
+                        elif kind == "ai_response":
+                            user_input_id = user_input_ids.get(record["user_input_id"])
+                            if session_id is None or user_input_id is None:
+                                batch_counts["skipped"] += 1
+                                continue
+                            ai_rows.append((
+                                session_id, user_input_id, "ai", *store_content(cursor, record["content"]),
+                                record.get("version", 1), record.get("edited_code") or ""
+                            ))
+                            batch_counts["ai_responses"] += 1
+                        else:
+                            raise ValueError(f"Unknown chat archive record type: {kind!r}")
+
+                    cursor.executemany(
+                        "INSERT INTO chat_messages (session_id, user_input_id, role, content, blob_hash, version, edited_code) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        ai_rows
+                    )
+                    self._invalidate(self._sessions_scope(), *(self._session_scope(title) for title in titles))
+                for key, count in batch_counts.items():
+                    counts[key] += count
+        except Exception as e:
+            logging.error(f"Import of chat history archive '{path}' failed after committing {counts}: {e}")
+            raise
 
-# if __name__ == "__main__":
-#     update_database_schema()
-    
\ No newline at end of file
+        logging.info(f"Imported chat history archive '{path}': {counts}.")
+        return counts
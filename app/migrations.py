@@ -0,0 +1,452 @@
+import sqlite3
+import threading
+import logging
+from app.db import get_connection, start_vacuum_thread, store_content, COMPRESSION_THRESHOLD
+
+# ================= Chat History Schema Migrations =================
+# Every migration is a function taking a cursor. Its position in MIGRATIONS (1-based)
+# is the schema version it upgrades the database to; the applied version is stored
+# in PRAGMA user_version. Only ever append new migrations to the end of the list.
+
+
+def _create_tables(cursor: sqlite3.Cursor):
+    """Version 1: the original chat history tables."""
+
+    # Create chat_sessions table with a timestamp column
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT UNIQUE NOT NULL,
+            file_name TEXT,   -- Added column for the uploaded file name
+            file_id TEXT,     -- Added column for the uploaded file id
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Create user_inputs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_inputs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (id)
+        )
+    """)
+
+    # Create chat_messages table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            user_input_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            version INTEGER DEFAULT 1,
+            edited_code TEXT,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (id),
+            FOREIGN KEY (user_input_id) REFERENCES user_inputs (id)
+        )
+    """)
+
+    # Databases created before responses were versioned lack the 'version' column
+    cursor.execute("PRAGMA table_info(chat_messages)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if "version" not in columns:
+        cursor.execute("ALTER TABLE chat_messages ADD COLUMN version INTEGER DEFAULT 1")
+
+
+def _create_indexes(cursor: sqlite3.Cursor):
+    """Version 2: secondary indexes for the per-session and per-input lookups."""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user_input_version
+        ON chat_messages (user_input_id, version)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_inputs_session
+        ON user_inputs (session_id, id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_timestamp
+        ON chat_sessions (timestamp)
+    """)
+
+
+def _add_user_input_hash(cursor: sqlite3.Cursor):
+    """Version 3: hash of the user input content so lookups by content use an index."""
+    cursor.execute("ALTER TABLE user_inputs ADD COLUMN content_hash TEXT")
+    cursor.execute("UPDATE user_inputs SET content_hash = content_hash(content)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_inputs_session_hash
+        ON user_inputs (session_id, content_hash)
+    """)
+
+
+# SQL expression extracting the "Query" from a user input's JSON content
+USER_QUERY_SQL = (
+    "CASE WHEN json_valid({row}.content) "
+    "THEN json_extract({row}.content, '$.Query') ELSE {row}.content END"
+)
+
+
+def _create_search_index(cursor: sqlite3.Cursor):
+    """
+    Version 4: FTS5 full-text index over user queries and AI responses, kept in sync by triggers.
+
+    user_inputs_fts stores only the "Query" of the user input JSON (it is small);
+    chat_messages_fts is an external-content index that reads responses from chat_messages.
+    """
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_inputs_fts
+        USING fts5(query, tokenize = 'porter unicode61')
+    """)
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts
+        USING fts5(content, content = 'chat_messages', content_rowid = 'id', tokenize = 'porter unicode61')
+    """)
+    _create_search_triggers(cursor)
+
+    # Index the existing history
+    cursor.execute(f"INSERT INTO user_inputs_fts (rowid, query) SELECT id, {USER_QUERY_SQL.format(row='user_inputs')} FROM user_inputs")
+    cursor.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+
+def _create_search_triggers(cursor: sqlite3.Cursor):
+    """(Re)create the triggers that keep the full-text indexes in sync with their tables."""
+    statements = [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS user_inputs_fts_insert AFTER INSERT ON user_inputs BEGIN
+            INSERT INTO user_inputs_fts (rowid, query) VALUES (new.id, {USER_QUERY_SQL.format(row='new')});
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS user_inputs_fts_delete AFTER DELETE ON user_inputs BEGIN
+            DELETE FROM user_inputs_fts WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS user_inputs_fts_update AFTER UPDATE OF content ON user_inputs BEGIN
+            DELETE FROM user_inputs_fts WHERE rowid = old.id;
+            INSERT INTO user_inputs_fts (rowid, query) VALUES (new.id, {USER_QUERY_SQL.format(row='new')});
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO chat_messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _add_cascading_deletes(cursor: sqlite3.Cursor):
+    """
+    Version 5: rebuild user_inputs and chat_messages with ON DELETE CASCADE foreign keys,
+    so deleting a chat session removes its inputs and responses in one statement.
+
+    SQLite can't alter foreign keys in place, so the tables are copied into new ones
+    and renamed. Row IDs and the AUTOINCREMENT counters are kept; the indexes, the
+    search triggers and the full-text search indexes are rebuilt.
+
+    Foreign keys weren't enforced before, so legacy databases can hold inputs and
+    responses whose session (or input) was deleted; those orphans are deleted first.
+    """
+    cursor.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('user_inputs', 'chat_messages')")
+    sequences = cursor.fetchall()
+
+    cursor.execute("DELETE FROM user_inputs WHERE session_id NOT IN (SELECT id FROM chat_sessions)")
+    orphans = cursor.rowcount
+    cursor.execute("""
+        DELETE FROM chat_messages
+        WHERE session_id NOT IN (SELECT id FROM chat_sessions)
+           OR (user_input_id IS NOT NULL AND user_input_id NOT IN (SELECT id FROM user_inputs))
+    """)
+    orphans += cursor.rowcount
+    if orphans:
+        logging.info(f"Deleted {orphans} chat history rows whose session no longer exists.")
+
+    cursor.execute("""
+        CREATE TABLE user_inputs_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            content_hash TEXT,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO user_inputs_new (id, session_id, content, content_hash)
+        SELECT id, session_id, content, content_hash FROM user_inputs
+    """)
+
+    cursor.execute("""
+        CREATE TABLE chat_messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            user_input_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            version INTEGER DEFAULT 1,
+            edited_code TEXT,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_input_id) REFERENCES user_inputs_new (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO chat_messages_new (id, session_id, user_input_id, role, content, version, edited_code)
+        SELECT id, session_id, user_input_id, role, content, version, edited_code FROM chat_messages
+    """)
+
+    # Dropping the tables also drops their indexes and triggers
+    cursor.execute("DROP TABLE chat_messages")
+    cursor.execute("DROP TABLE user_inputs")
+    # Renaming also rewrites the reference from chat_messages_new to user_inputs_new
+    cursor.execute("ALTER TABLE user_inputs_new RENAME TO user_inputs")
+    cursor.execute("ALTER TABLE chat_messages_new RENAME TO chat_messages")
+
+    # Never hand out IDs of deleted rows again; cached responses are keyed by user input ID
+    for name, seq in sequences:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq, name))
+
+    _create_indexes(cursor)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_inputs_session_hash
+        ON user_inputs (session_id, content_hash)
+    """)
+    # Cascading deletes look up the responses of a session by session_id
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+        ON chat_messages (session_id)
+    """)
+
+    _create_search_triggers(cursor)
+    cursor.execute("DELETE FROM user_inputs_fts")
+    cursor.execute(f"INSERT INTO user_inputs_fts (rowid, query) SELECT id, {USER_QUERY_SQL.format(row='user_inputs')} FROM user_inputs")
+    cursor.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+
+def _compress_responses(cursor: sqlite3.Cursor):
+    """
+    Version 6: store large AI responses compressed and deduplicated in content_blobs.
+
+    chat_messages.blob_hash points at the blob (content is then empty). The view
+    chat_messages_text decodes every response with the inflate() SQL function that the
+    pooled connections register, and the response search index now reads from it.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS content_blobs (
+            hash TEXT PRIMARY KEY,   -- content_hash() of the decoded text
+            encoding TEXT NOT NULL,  -- 'zlib' or 'raw'
+            data BLOB NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("ALTER TABLE chat_messages ADD COLUMN blob_hash TEXT")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_blob
+        ON chat_messages (blob_hash)
+    """)
+
+    # The old search triggers would index the emptied content; they are replaced below
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS chat_messages_fts_{trigger}")
+    cursor.execute("DROP TABLE IF EXISTS chat_messages_fts")
+
+    # Move existing large responses into blobs, a batch at a time to bound memory
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, content FROM chat_messages
+            WHERE id > ? AND blob_hash IS NULL AND length(CAST(content AS BLOB)) >= ?
+            ORDER BY id
+            LIMIT 200
+        """, (last_id, COMPRESSION_THRESHOLD))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for message_id, content in rows:
+            stored_content, blob_hash = store_content(cursor, content)
+            cursor.execute(
+                "UPDATE chat_messages SET content = ?, blob_hash = ? WHERE id = ?",
+                (stored_content, blob_hash, message_id)
+            )
+        last_id = rows[-1][0]
+
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS chat_messages_text AS
+        SELECT cm.id,
+               CASE WHEN cm.blob_hash IS NULL THEN cm.content
+                    ELSE inflate(cb.encoding, cb.data) END AS content
+        FROM chat_messages cm
+        LEFT JOIN content_blobs cb ON cb.hash = cm.blob_hash
+    """)
+    cursor.execute("""
+        CREATE VIRTUAL TABLE chat_messages_fts
+        USING fts5(content, content = 'chat_messages_text', content_rowid = 'id', tokenize = 'porter unicode61')
+    """)
+    _create_message_search_triggers(cursor)
+    cursor.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+
+def _create_message_search_triggers(cursor: sqlite3.Cursor):
+    """
+    Create the triggers keeping chat_messages_fts in sync with the decoded responses.
+    Old values are removed from the index BEFORE a change, while chat_messages_text can
+    still decode them; new values are added AFTER it.
+    """
+    statements = [
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (rowid, content)
+            SELECT id, content FROM chat_messages_text WHERE id = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete BEFORE DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content)
+            SELECT 'delete', id, content FROM chat_messages_text WHERE id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_before_update BEFORE UPDATE OF content, blob_hash ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content)
+            SELECT 'delete', id, content FROM chat_messages_text WHERE id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_after_update AFTER UPDATE OF content, blob_hash ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (rowid, content)
+            SELECT id, content FROM chat_messages_text WHERE id = new.id;
+        END
+        """,
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _add_session_activity_index(cursor: sqlite3.Cursor):
+    """
+    Version 7: index the session list order (last activity, then ID) so a page of the
+    sidebar is read straight from the index from any (timestamp, id) cursor.
+    """
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_activity
+        ON chat_sessions (timestamp, id)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_chat_sessions_timestamp")
+
+
+MIGRATIONS = [
+    _create_tables,
+    _create_indexes,
+    _add_user_input_hash,
+    _create_search_index,
+    _add_cascading_deletes,
+    _compress_responses,
+    _add_session_activity_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Migrations after which PRAGMA foreign_key_check must pass. Only the rebuild of the
+# tables enforces their foreign keys (and deletes the orphans first); the versions
+# before it run on legacy databases that may still hold orphans.
+CHECK_FOREIGN_KEYS_AFTER = {_add_cascading_deletes}
+
+# Run by the background vacuum thread before every pass
+MAINTENANCE_SQL = [
+    # Blobs no longer referenced by any response (deleted sessions, edited responses)
+    """
+    DELETE FROM content_blobs
+    WHERE NOT EXISTS (SELECT 1 FROM chat_messages WHERE blob_hash = content_blobs.hash)
+    """,
+]
+
+# PRAGMA auto_vacuum value of INCREMENTAL mode
+AUTO_VACUUM_INCREMENTAL = 2
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+
+def migrate(conn: sqlite3.Connection):
+    """
+    Apply all pending migrations to the database behind conn.
+
+    Each migration runs in its own IMMEDIATE transaction together with the
+    user_version bump, so a failed migration leaves the previous version intact
+    and concurrent processes never apply the same migration twice.
+
+    Foreign key enforcement is off while migrating so that tables can be rebuilt;
+    the migrations in CHECK_FOREIGN_KEYS_AFTER must leave the foreign keys consistent
+    before they commit.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    try:
+        _apply_migrations(conn, cursor)
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+
+
+def _apply_migrations(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Apply pending migrations one transaction at a time; see migrate()."""
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                conn.commit()
+                return
+
+            migration = MIGRATIONS[version]
+            migration(cursor)
+            violations = []
+            if migration in CHECK_FOREIGN_KEYS_AFTER:
+                violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise sqlite3.IntegrityError(f"{migration.__name__} left foreign key violations: {violations[:5]}")
+            # PRAGMA doesn't accept bound parameters; version is always an int
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+            logging.info(f"Migrated chat history schema to version {version + 1} ({migration.__name__}).")
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def ensure_schema(db_path: str):
+    """Migrate db_path to the latest schema once per process."""
+    if db_path in _migrated_paths:
+        return
+
+    with _migrate_lock:
+        if db_path not in _migrated_paths:
+            conn = get_connection(db_path)
+            enable_incremental_vacuum(conn)
+            migrate(conn)
+            _migrated_paths.add(db_path)
+            start_vacuum_thread(db_path, maintenance=MAINTENANCE_SQL)
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """
+    Switch the database to auto_vacuum = INCREMENTAL so that free pages can be returned
+    to the file system. New databases take the setting right away; existing ones need
+    a one-time full VACUUM (which can't run inside a transaction) to convert.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        logging.info("Converting chat history database to incremental auto-vacuum.")
+        cursor.execute("VACUUM")
@@ -0,0 +1,141 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from app.db import RESPONSE_CACHE_DB, get_connection, transaction
+
+# ================= Dify Response Cache =================
+# Outputs of successful workflow runs, keyed by a canonical hash of the run's inputs
+# and the workflow, so a repeated question (same query, paper and truncated history)
+# is answered from disk instead of a new run.
+
+# Seconds a cached response stays valid
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+# Cached responses kept; the least recently used are evicted beyond this
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+
+def request_key(data: dict, base_url: str, api_key: str) -> str:
+    """
+    Return the canonical hash identifying a workflow run: its "inputs" and the workflow,
+    which is identified by the Dify API URL and (a hash of) its app key. The response
+    mode doesn't matter, as streaming and blocking runs have the same outputs.
+    """
+    canonical = json.dumps(
+        {
+            "workflow": [base_url.rstrip("/"), hashlib.sha256(api_key.encode("utf-8")).hexdigest()],
+            "inputs": data["inputs"],
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of workflow outputs with a TTL and least-recently-used eviction,
+    shared by every session of the process.
+    """
+
+    def __init__(self, db_path: str = RESPONSE_CACHE_DB, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+        conn = get_connection(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                outputs TEXT NOT NULL,    -- JSON outputs of the workflow run
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+
+    def get(self, key: str):
+        """Return the cached outputs for key, or None if there are none or they expired."""
+        now = time.time()
+        with transaction(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT outputs FROM response_cache WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE response_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def bypass(self):
+        """Count a lookup skipped on purpose, e.g. to regenerate a response."""
+        with self._lock:
+            self.bypasses += 1
+
+    def put(self, key: str, outputs: dict):
+        """Cache the outputs of a run, dropping expired and least recently used entries."""
+        now = time.time()
+        with transaction(self.db_path) as conn:
+            conn.execute("""
+                INSERT INTO response_cache (key, outputs, created_at, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    outputs = excluded.outputs, created_at = excluded.created_at, last_used = excluded.last_used
+            """, (key, json.dumps(outputs, ensure_ascii=False), now, now))
+            evicted = conn.execute("DELETE FROM response_cache WHERE created_at <= ?", (now - self.ttl,)).rowcount
+            excess = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted += conn.execute("""
+                    DELETE FROM response_cache WHERE key IN (
+                        SELECT key FROM response_cache ORDER BY last_used LIMIT ?
+                    )
+                """, (excess,)).rowcount
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def clear(self):
+        """Drop every cached response."""
+        with transaction(self.db_path) as conn:
+            conn.execute("DELETE FROM response_cache")
+        logging.info("Response cache cleared.")
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters of this process and the number of cached responses."""
+        entries = get_connection(self.db_path).execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide ResponseCache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,75 @@
+import logging
+import threading
+
+# ================= Outstanding Workflow Runs =================
+# Dify keeps running a workflow after the Streamlit session that started it moved on
+# (switched or deleted the chat, ...). Tracking the runs of each session lets them be
+# abandoned, which stops them in Dify unless another session still waits for them.
+
+# Outstanding runs a session may have; starting another abandons its oldest
+MAX_RUNS_PER_SESSION = 2
+
+
+class RunTracker:
+    """
+    Outstanding workflow runs of each session, as (done, abandon) callables: done()
+    tells whether the run ended, abandon() gives it up on behalf of the session. A run
+    joined again by the same session (a rerun re-issuing the request) is tracked once.
+    """
+
+    def __init__(self, max_runs_per_session: int = MAX_RUNS_PER_SESSION):
+        self.max_runs_per_session = max_runs_per_session
+        self._runs = {}  # session key -> [(done, abandon, run)], oldest first
+        self._lock = threading.Lock()
+        self.abandoned = 0
+
+    def track(self, session_key, done, abandon, run=None):
+        """
+        Track a run of session_key, abandoning its oldest runs beyond the cap. run
+        identifies the run: tracking a run the session already tracks does nothing.
+        """
+        with self._lock:
+            runs = [entry for entry in self._runs.get(session_key, []) if not entry[0]()]
+            if run is not None and any(entry[2] is run for entry in runs):
+                self._runs[session_key] = runs
+                return
+            runs.append((done, abandon, run))
+            excess = runs[:-self.max_runs_per_session]
+            self._runs[session_key] = runs[-self.max_runs_per_session:]
+            self.abandoned += len(excess)
+
+        if excess:
+            logging.warning(f"Session {session_key} has too many outstanding Dify runs; abandoning {len(excess)}.")
+        for _, abandon_run, _ in excess:
+            abandon_run()
+
+    def abandon(self, session_key) -> int:
+        """Abandon every outstanding run of session_key and return how many there were."""
+        with self._lock:
+            runs = [run for run in self._runs.pop(session_key, []) if not run[0]()]
+            self.abandoned += len(runs)
+
+        for _, abandon_run, _ in runs:
+            abandon_run()
+        if runs:
+            logging.info(f"Abandoned {len(runs)} outstanding Dify run(s) of session {session_key}.")
+        return len(runs)
+
+    def outstanding(self, session_key=None) -> int:
+        """Return the number of outstanding runs of session_key, or of every session."""
+        with self._lock:
+            sessions = [session_key] if session_key is not None else list(self._runs)
+            return sum(not done() for key in sessions for done, _, _ in self._runs.get(key, []))
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_run_tracker() -> RunTracker:
+    """Return the process-wide RunTracker."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = RunTracker()
+        return _tracker
@@ -3,6 +3,9 @@ import streamlit as st  # Import Streamlit for creating the web app
 import app.app_utils as app_utils  # Import custom utility functions
 
 from app.app_settings import AppSettings
+from app.response_cache import get_response_cache
+from app.dify_metrics import get_metrics
+from app.dify_admission import get_admission
 import app.markdown as markdown  # Import custom markdown styles
 import requests
 import logging
@@ -66,8 +69,51 @@ if api_key := st.text_input(
     settings.DIFY_API_KEY = api_key
     settings.save()
 
-    
-            
+
+# ================= Chat History Settings =================
+settings.ASYNC_WRITES = str(st.checkbox(
+    "Save chat history in the background",
+    value=settings.ASYNC_WRITES == "True",
+    help="Queue chat history writes for a single writer thread so the chat never waits for the database lock.",
+))
+
+# ================= Response Cache Settings =================
+settings.RESPONSE_CACHE = str(st.checkbox(
+    "Cache Dify responses",
+    value=settings.RESPONSE_CACHE == "True",
+    help="Answer repeated questions (same query, paper and recent history) from a local cache. 🔄 Regenerate always asks Dify again.",
+))
+if settings.RESPONSE_CACHE == "True":
+    response_cache = get_response_cache()
+    cache_stats = response_cache.stats()
+    st.caption(
+        f"{cache_stats['entries']} cached responses · {cache_stats['hits']} hits · "
+        f"{cache_stats['misses']} misses · hit rate {cache_stats['hit_rate']:.0%}"
+    )
+    if st.button("Clear response cache"):
+        response_cache.clear()
+        st.success("Response cache cleared!")
+
+# ================= Dify Call Stats =================
+with st.expander("Dify call stats"):
+    admission_stats = get_admission().stats()
+    st.caption(
+        f"{admission_stats['active']}/{admission_stats['max_concurrent']} calls in flight · "
+        f"{admission_stats['queued']} queued · circuit breaker {admission_stats['breaker']} "
+        f"({admission_stats['breaker_rejections']} calls refused, {admission_stats['queue_timeouts']} timed out in the queue)"
+    )
+    dify_metrics = get_metrics()
+    call_summary = dify_metrics.summary()
+    if call_summary:
+        st.caption("Recent Dify calls of this server process (latencies in ms, sizes in KB).")
+        st.dataframe(call_summary, hide_index=True, use_container_width=True)
+        st.dataframe(dify_metrics.recent(), hide_index=True, use_container_width=True)
+        if st.button("Reset call stats"):
+            dify_metrics.reset()
+            st.rerun()
+    else:
+        st.caption("No Dify calls yet.")
+
 # ================= Save Settings =================
 
 if st.sidebar.button(
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+# ================= Single-Flight Call Coalescing =================
+# Identical Dify calls issued at the same time (a double click, two sessions asking
+# the same question about the same paper) share one workflow run instead of each
+# starting its own.
+
+
+class _LeaderInterrupted(Exception):
+    """The leader of a flight was interrupted (not failed); its joiners run the call again."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls across threads: the first caller for a key
+    (the leader) runs the call, and callers arriving with the same key while it is in
+    flight wait for it and receive the same result, or the same exception.
+
+    Only errors (Exception) are shared. If the leader is interrupted by anything else,
+    e.g. Streamlit stopping its script run, that only propagates in the leader: the
+    flight is dropped and its joiners try again, one of them becoming the leader.
+
+    With hold=True the key stays in flight after the call returns, until release() is
+    called; this lets callers join a result that is still being produced, such as a stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, call, hold: bool = False):
+        """
+        Run call() unless a call with the same key is in flight, and return its result.
+
+        Returns:
+            tuple: (result, shared), shared being whether the result came from another caller's call.
+        """
+        while True:
+            with self._lock:
+                future = self._flights.get(key)
+                leader = future is None
+                if leader:
+                    future = self._flights[key] = Future()
+                    self.calls += 1
+                else:
+                    self.shared += 1
+
+            if leader:
+                break
+            logging.info("Joined an identical in-flight Dify call.")
+            try:
+                return future.result(), True
+            except _LeaderInterrupted:
+                logging.info("The leader of an in-flight Dify call was interrupted; trying again.")
+
+        try:
+            result = call()
+        except Exception as e:
+            self.release(key, future)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self.release(key, future)
+            future.set_exception(_LeaderInterrupted())
+            raise
+        if not hold:
+            self.release(key, future)
+        future.set_result(result)
+        return result, False
+
+    def release(self, key, future: Future = None):
+        """End the flight of key, so the next call with it runs again; only future's flight if given."""
+        with self._lock:
+            if future is None or self._flights.get(key) is future:
+                self._flights.pop(key, None)
+
+    def in_flight(self) -> int:
+        """Return the number of calls currently in flight."""
+        with self._lock:
+            return len(self._flights)
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent identical coroutine calls on one event loop, like SingleFlight.
+
+    The call runs as a task of its own, so a caller being cancelled doesn't cancel it
+    for the others; it is only cancelled once every caller waiting for it was.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, call):
+        """Await call() unless a call with the same key is in flight, and return its result."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = {"task": asyncio.ensure_future(call()), "waiters": 0}
+            flight["task"].add_done_callback(lambda _: self._flights.get(key) is flight and self._flights.pop(key))
+        else:
+            logging.info("Joined an identical in-flight Dify call.")
+
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        except asyncio.CancelledError:
+            if flight["waiters"] == 1:
+                flight["task"].cancel()
+            raise
+        finally:
+            flight["waiters"] -= 1
@@ -44,6 +44,10 @@ def initialize_state():
     
     if "new_chat" not in st.session_state:
         st.session_state["new_chat"] = False
+
+    # ================== Number of session list pages shown in the sidebar ==================
+    if "session_pages" not in st.session_state:
+        st.session_state["session_pages"] = 1
     
     
     
@@ -59,6 +63,14 @@ def initialize_state():
     if "copied" not in st.session_state: 
         st.session_state.copied = []
     
+    # ================== Keyset cursor of the oldest loaded turn (None when the whole chat is loaded) ==================
+    if "history_cursor" not in st.session_state:
+        st.session_state["history_cursor"] = None
+
+    # Number of turns loaded, kept when the chat is reloaded after a regenerate or an edit
+    if "history_turns" not in st.session_state:
+        st.session_state["history_turns"] = 0
+
     if "file_info" not in st.session_state:
         st.session_state["file_info"] = {"name" : "", "id" : "", "report": ""}
     
@@ -28,6 +28,9 @@ def truncate_helper(messages: List[Dict[str, str]], max_size: int) -> List[Dict[
 
 context = ""
 
+# Characters of the query and chat history sent to the workflow
+MAX_CONTEXT_SIZE = 6000
+
 def trancate(query: str, history: List = []) -> dict:
     """
     Dynamically truncate all components to fit within the total context size.
@@ -39,10 +42,6 @@ def trancate(query: str, history: List = []) -> dict:
     Returns:
         dict: A dictionary containing the truncated query, model, history, and system_prompt.
     """
-    MAX_CONTEXT_SIZE = 6000
-
-
-
     # Calculate the size of all components
     query_size = len(query)
     history_size = sum(len(json.dumps(msg)) for msg in history)
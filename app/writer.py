@@ -0,0 +1,163 @@
+import queue
+import threading
+import logging
+import atexit
+from concurrent.futures import Future
+from app.db import transaction
+
+# Maximum number of queued writes committed together in one transaction
+WRITE_BATCH_SIZE = 50
+
+
+def current_session_key():
+    """
+    Identify the Streamlit session issuing a write, for read-your-writes tracking.
+    Falls back to the thread when running outside of Streamlit.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    return f"thread-{threading.get_ident()}"
+
+
+class BackgroundWriter:
+    """
+    Single dedicated thread that applies queued database writes in FIFO order.
+
+    Writes are submitted as callables and executed on the writer thread's own pooled
+    connection. Consecutive queued writes are group-committed in one transaction, each
+    in its own savepoint, so a failing write doesn't undo the others. Every submit()
+    returns a Future that resolves once the write is committed.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = WRITE_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._last_write = {}  # session key -> Future of its most recent write
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, session_key, write) -> Future:
+        """Queue write() on behalf of session_key and return a Future of its result."""
+        future = Future()
+        with self._lock:
+            self._last_write[session_key] = future
+        future.add_done_callback(lambda f: self._forget(session_key, f))
+        self._queue.put((write, future))
+        return future
+
+    def _forget(self, session_key, future):
+        with self._lock:
+            if self._last_write.get(session_key) is future:
+                del self._last_write[session_key]
+
+    def wait_for(self, session_key, timeout: float = None):
+        """
+        Block until every write submitted by session_key is committed, so the session
+        reads its own writes. Failed writes don't raise here; they were logged.
+        """
+        with self._lock:
+            future = self._last_write.get(session_key)
+        if future is not None:
+            future.exception(timeout)
+
+    def flush(self):
+        """Block until every queued write has been applied."""
+        self._queue.join()
+
+    def stop(self):
+        """Apply the remaining writes and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            batch = [job]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+
+            self._apply(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _apply(self, batch):
+        """Commit a batch of writes together and resolve their futures."""
+        results = []
+        try:
+            with transaction(self.db_path):
+                for write, future in batch:
+                    try:
+                        with transaction(self.db_path):
+                            results.append((future, write(), None))
+                    except Exception as e:
+                        logging.error(f"Background chat history write failed: {e}")
+                        results.append((future, None, e))
+        except Exception as e:
+            logging.error(f"Committing background chat history writes failed: {e}")
+            results = [(future, None, e) for write, future in batch]
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path: str):
+    """Return the running background writer of db_path, or None."""
+    return _writers.get(db_path)
+
+
+def set_async_writes(db_path: str, enabled: bool):
+    """Start or stop (after flushing) the process-wide background writer of db_path."""
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if enabled and writer is None:
+            _writers[db_path] = BackgroundWriter(db_path)
+            logging.info(f"Background writes to '{db_path}' enabled.")
+        elif not enabled and writer is not None:
+            del _writers[db_path]
+            writer.stop()
+            logging.info(f"Background writes to '{db_path}' disabled.")
+
+
+def stop_all_writers():
+    """Flush and stop every background writer, e.g. when the process shuts down."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+
+
+atexit.register(stop_all_writers)
@@ -0,0 +1,64 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import platform
+import statistics
+
+# ================= Benchmark Helpers =================
+# Shared by the benchmark scripts in this folder.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile (fraction between 0 and 1) of samples."""
+    ordered = sorted(samples)
+    rank = max(math.ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """Summarize latency samples in seconds as milliseconds."""
+    return {
+        "iterations": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def environment():
+    """Describe the machine and library versions the results were measured with."""
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(name, config, results, path=None):
+    """
+    Save benchmark results as JSON, by default to results/<name>-<timestamp>.json.
+
+    Returns:
+        str: The path written.
+    """
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"benchmark": name, "environment": environment(), "config": config, "results": results}, file, indent=2)
+    return path
+
+
+def print_table(results, columns):
+    """Print results (a list of dicts) as an aligned text table of the given columns."""
+    widths = {column: max(len(column), *(len(str(row.get(column, ""))) for row in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in results:
+        print("  ".join(str(row.get(column, "")).ljust(widths[column]) for column in columns))
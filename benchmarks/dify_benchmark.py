@@ -0,0 +1,210 @@
+import os
+import time
+import uuid
+import logging
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from app import conversation
+from app.dify import llm_chat, llm_chat_stream, NO_RESPONSE
+from app.history import ChatHistory
+from benchmarks.common import summarize, write_results, print_table
+from benchmarks.mock_dify import MockConfig, MockDifyServer
+
+# ================= Dify Client Benchmark =================
+# Drives the app's Dify paths against the local mock server (benchmarks/mock_dify.py),
+# so no network or LLM is involved, and reports their latency, the client-side overhead
+# (latency minus the time the mock spends on purpose) and throughput per concurrency.
+#
+#   python -m benchmarks.dify_benchmark
+#   python -m benchmarks.dify_benchmark --concurrency 1 8 --latency 0.2 --chunks 50 --error-rate 0.05
+
+SCENARIOS = ["llm_chat", "llm_chat_stream", "upload_to_dify", "send_message", "send_message_new_chat"]
+
+
+def answered(response):
+    """Whether a call got an answer; failed and refused calls return an empty or placeholder response."""
+    return bool(response) and response != NO_RESPONSE
+
+
+def chat_input(query, new_chat=False):
+    """The workflow inputs of a chat message, as app_utils.gen_user_input builds them."""
+    return {"Query": query, "new_chat": str(new_chat), "Knownledge_Base_Name": ""}
+
+
+class Scenarios:
+    """The measured operations; each call does one request of the scenario for worker."""
+
+    def __init__(self, server: MockDifyServer, directory: str, upload_size: int):
+        self.settings = SimpleNamespace(DIFY_API_URL=server.url, DIFY_API_KEY="mock", RESPONSE_CACHE="False")
+        self.history = ChatHistory(os.path.join(directory, "chat_history.db"))
+        self.upload_path = os.path.join(directory, "paper.md")
+        with open(self.upload_path, "w", encoding="utf-8") as file:
+            file.write("# Paper\n" + "lorem ipsum " * (upload_size // 12))
+        self._upload_to_dify = None
+        self.first_chunks = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def query(worker, i):
+        # Unique per call, so identical in-flight runs aren't coalesced into one
+        return f"Question {i} of worker {worker}: {uuid.uuid4().hex}"
+
+    def llm_chat(self, worker, i):
+        _, response = llm_chat(chat_input(self.query(worker, i)), self.settings, [])
+        return answered(response)
+
+    def llm_chat_stream(self, worker, i):
+        started = time.perf_counter()
+        stream = llm_chat_stream(chat_input(self.query(worker, i)), self.settings, [])
+        first_chunk = None
+        # Iterate to the end: a stream left early counts as abandoned and is stopped
+        for chunk in stream:
+            if chunk and first_chunk is None:
+                first_chunk = time.perf_counter() - started
+        if first_chunk is not None:
+            with self._lock:
+                self.first_chunks.append(first_chunk)
+        return answered(stream.response)
+
+    def upload_to_dify(self, worker, i):
+        if self._upload_to_dify is None:
+            # Imported lazily: the upload module pulls in the PDF conversion dependencies
+            import app.file_upload as file_upload
+
+            file_upload.settings.DIFY_API_URL = self.settings.DIFY_API_URL
+            file_upload.settings.DIFY_API_KEY = self.settings.DIFY_API_KEY
+            self._upload_to_dify = file_upload.upload_to_dify
+        return self._upload_to_dify(self.upload_path, f"paper-{worker}-{i}.md") is not None
+
+    def last_answer(self, title):
+        """The AI response of the last turn saved to the chat."""
+        rows = self.history.fetch_conversation(title, limit=1)
+        return (rows[-1][3] or "") if rows else ""
+
+    def send_message(self, worker, i):
+        """chat.send_message for an existing chat: stream the answer, save the turn, reload the chat."""
+        title = f"Benchmark chat {worker}"
+        if i == 0:
+            self.history.create_chat_session(title)
+        title = conversation.send_turn(chat_input(self.query(worker, i)), title, self.settings, self.history)
+        self.history.load_chat_into_session_state(title)
+        return answered(self.last_answer(title))
+
+    def send_message_new_chat(self, worker, i):
+        """chat.send_message for a new chat: the title run overlaps the answer, then the chat is renamed."""
+        query = self.query(worker, i)
+        title_input = chat_input(conversation.TITLE_PROMPT.format(query=query), True)
+        title, title_run = conversation.start_chat(title_input, self.settings, self.history)
+        title = conversation.send_turn(chat_input(query), title, self.settings, self.history, title_run)
+        return answered(self.last_answer(title))
+
+
+def measure(operation, concurrency, iterations, warmup):
+    """
+    Run operation(worker, i) iterations times on each of concurrency threads, after
+    warmup unmeasured calls per thread (imports, pooled connections).
+
+    Returns:
+        tuple: (latency samples in seconds, failed calls, wall-clock seconds)
+    """
+    samples = []
+    failures = [0]
+    lock = threading.Lock()
+    # Throughput is measured once every thread is done warming up
+    warmed_up = threading.Barrier(concurrency + 1)
+
+    def work(worker):
+        for i in range(iterations + warmup):
+            if i == warmup:
+                warmed_up.wait()
+            start = time.perf_counter()
+            try:
+                ok = operation(worker, i)
+            except Exception as e:
+                logging.warning(f"Benchmark call failed: {e!r}")
+                ok = False
+            elapsed = time.perf_counter() - start
+            if i < warmup:
+                continue
+            with lock:
+                samples.append(elapsed)
+                failures[0] += not ok
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    warmed_up.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, failures[0], time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's Dify client paths against a local mock Dify server.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent callers.")
+    parser.add_argument("--iterations", type=int, default=20, help="Calls per caller.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured calls per caller first.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock seconds before a run answers.")
+    parser.add_argument("--chunks", type=int, default=20, help="Mock text_chunk events per run.")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="Mock seconds between text chunks.")
+    parser.add_argument("--response-size", type=int, default=1500, help="Mock characters per response.")
+    parser.add_argument("--upload-size", type=int, default=50000, help="Bytes of the uploaded markdown file.")
+    parser.add_argument("--upload-latency", type=float, default=0.0, help="Mock seconds per upload.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock requests failing.")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--run-failure-rate", type=float, default=0.0, help="Share of mock runs finishing with status failed.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/dify-<timestamp>.json).")
+    args = parser.parse_args(argv)
+
+    # The app logs every Dify call at INFO level; keep the benchmark out of app.log
+    logging.getLogger().setLevel(logging.WARNING)
+
+    config = MockConfig(
+        latency=args.latency,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        response_size=args.response_size,
+        upload_latency=args.upload_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        run_failure_rate=args.run_failure_rate,
+        seed=args.seed,
+    )
+    service_times = {scenario: config.service_time() for scenario in SCENARIOS}
+    service_times["upload_to_dify"] = config.upload_latency
+
+    results = []
+    with MockDifyServer(config) as server, tempfile.TemporaryDirectory() as directory:
+        scenarios = Scenarios(server, directory, args.upload_size)
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                scenarios.first_chunks.clear()
+                samples, failures, wall = measure(getattr(scenarios, scenario), concurrency, args.iterations, args.warmup)
+                overhead = [max(sample - service_times[scenario], 0.0) for sample in samples]
+                result = {
+                    "scenario": scenario,
+                    "concurrency": concurrency,
+                    **summarize(samples),
+                    "overhead_p50_ms": summarize(overhead)["p50_ms"],
+                    "overhead_p95_ms": summarize(overhead)["p95_ms"],
+                    "calls_per_s": round(len(samples) / wall, 1),
+                    "failures": failures,
+                }
+                if scenarios.first_chunks:
+                    result["first_chunk_p50_ms"] = summarize(scenarios.first_chunks)["p50_ms"]
+                results.append(result)
+                print(f"{scenario} × {concurrency}: p50 {result['p50_ms']} ms, {result['calls_per_s']} calls/s")
+        requests_served = dict(server.requests)
+
+    print_table(results, ["scenario", "concurrency", "p50_ms", "p95_ms", "overhead_p50_ms", "overhead_p95_ms", "calls_per_s", "failures"])
+    config = {**vars(args), "requests_served": requests_served}
+    print(f"Results saved to {write_results('dify', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+from app.db import get_connection
+from app.history import ChatHistory, history_cache
+from benchmarks.common import summarize, write_results, print_table
+
+# ================= ChatHistory Storage Benchmark =================
+# Generates synthetic chat history databases of several sizes and measures the
+# latency (p50/p95) and number of SQL statements of the main ChatHistory operations.
+#
+#   python -m benchmarks.history_benchmark
+#   python -m benchmarks.history_benchmark --sessions 10 1000 --turns 20 --versions 3 --warm
+
+WORDS = (
+    "graph paper citation author model neural network dataset result method analysis "
+    "knowledge research query retrieval embedding transformer survey baseline metric"
+).split()
+
+# Sessions created per transaction while generating a database
+POPULATE_BATCH_SIZE = 500
+
+
+class QueryCounter:
+    """
+    Count the SQL statements run on a connection through its trace callback, including
+    transaction control and the statements FTS5 runs to maintain its indexes.
+    """
+
+    def __init__(self, conn):
+        self.count = 0
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, statement):
+        # Statements run by triggers are reported as "-- TRIGGER name"; count only ours
+        if not statement.startswith("--"):
+            self.count += 1
+
+
+def synthetic_text(rng, size):
+    """Return about size characters of random words."""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def user_input(rng, query_size):
+    return json.dumps({"Query": synthetic_text(rng, query_size), "new_chat": "False"})
+
+
+def populate(history, rng, sessions, turns, versions, query_size, response_size):
+    """Fill history with sessions × turns × versions synthetic rows."""
+    for start in range(0, sessions, POPULATE_BATCH_SIZE):
+        with history.transaction():
+            for index in range(start, min(start + POPULATE_BATCH_SIZE, sessions)):
+                title = f"Session {index}"
+                history.create_chat_session(title)
+                history.add_turns(title, [
+                    (user_input(rng, query_size), [synthetic_text(rng, response_size) for _ in range(versions)])
+                    for _ in range(turns)
+                ])
+
+
+def measure(operation, iterations, counter, warm):
+    """
+    Call operation(i) for every iteration and return its latency and statement counts.
+    Unless warm, the read cache is emptied before each call so SQLite is measured.
+    """
+    samples = []
+    queries = 0
+    for i in range(iterations):
+        if not warm:
+            history_cache.clear()
+        counter.count = 0
+        start = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - start)
+        queries += counter.count
+    return {**summarize(samples), "queries_per_call": round(queries / iterations, 2)}
+
+
+def run(size, args, directory):
+    """Generate a database with size sessions and benchmark every operation on it."""
+    rng = random.Random(args.seed)
+    db_path = os.path.join(directory, f"chat_history_{size}.db")
+    history = ChatHistory(db_path)
+
+    start = time.perf_counter()
+    populate(history, rng, size, args.turns, args.versions, args.query_size, args.response_size)
+    populate_seconds = time.perf_counter() - start
+    print(f"Generated {size} sessions in {populate_seconds:.1f}s ({os.path.getsize(db_path) / 1e6:.1f} MB)")
+
+    counter = QueryCounter(get_connection(db_path))
+    titles = history.fetch_chat_sessions()
+    pick = lambda i: titles[rng.randrange(len(titles))]
+
+    def add_turn(i):
+        # Saved like ChatHistory callers save a turn: both writes in one transaction
+        title = pick(i)
+        with history.transaction():
+            user_input_id = history.add_user_input(title, user_input(rng, args.query_size))
+            history.add_ai_response(title, user_input_id, synthetic_text(rng, args.response_size))
+
+    # Delete sessions from the end of the list so every iteration deletes a different one
+    deletions = titles[-min(args.iterations, len(titles)):]
+
+    operations = [
+        ("fetch_chat_sessions", lambda i: history.fetch_chat_sessions(), args.iterations),
+        ("load_chat_into_session_state", lambda i: history.load_chat_into_session_state(pick(i)), args.iterations),
+        ("load_chat_history", lambda i: history.load_chat_history(pick(i)), args.iterations),
+        ("add_user_input+add_ai_response", add_turn, args.iterations),
+        ("delete_chat_session", lambda i: history.delete_chat_session(deletions[i]), len(deletions)),
+    ]
+
+    results = []
+    for name, operation, iterations in operations:
+        result = {"sessions": size, "operation": name, **measure(operation, iterations, counter, args.warm)}
+        results.append(result)
+    get_connection(db_path).set_trace_callback(None)
+    return results, populate_seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ChatHistory storage layer on synthetic data.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 1000, 10000], help="Database sizes in sessions.")
+    parser.add_argument("--turns", type=int, default=5, help="Turns (user inputs) per session.")
+    parser.add_argument("--versions", type=int, default=2, help="AI response versions per turn.")
+    parser.add_argument("--query-size", type=int, default=80, help="Characters per user query.")
+    parser.add_argument("--response-size", type=int, default=1500, help="Characters per AI response.")
+    parser.add_argument("--iterations", type=int, default=50, help="Calls measured per operation.")
+    parser.add_argument("--warm", action="store_true", help="Keep the read cache between calls.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/history-<timestamp>.json).")
+    args = parser.parse_args(argv)
+
+    # The app logs every write at INFO level; keep the benchmark out of app.log
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    populate_seconds = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sessions:
+            size_results, populate_seconds[size] = run(size, args, directory)
+            results.extend(size_results)
+
+    print_table(results, ["sessions", "operation", "p50_ms", "p95_ms", "queries_per_call"])
+    config = {**vars(args), "populate_seconds": populate_seconds}
+    print(f"Results saved to {write_results('history', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ================= Mock Dify Server =================
+# Local stand-in for the Dify API endpoints ResearchFlow calls, for benchmarks and
+# offline testing: POST /workflows/run (blocking and streaming), POST
+# /workflows/tasks/{task_id}/stop and POST /files/upload. Latency, response size and
+# errors are configurable. Run it on its own and point the Dify API URL setting at it:
+#
+#   python -m benchmarks.mock_dify --port 5001 --latency 0.5 --chunks 40
+
+WORDS = (
+    "graph paper citation author model neural network dataset result method analysis "
+    "knowledge research query retrieval embedding transformer survey baseline metric"
+).split()
+
+
+class MockConfig:
+    """
+    Behaviour of the mock server; attributes can be changed while it runs.
+
+    Attributes:
+        latency (float): Seconds before a workflow run starts answering.
+        chunks (int): text_chunk events a streaming run sends.
+        chunk_interval (float): Seconds between two text_chunk events.
+        response_size (int): Characters of the generated response.
+        upload_latency (float): Seconds an upload takes.
+        error_rate (float): Share of requests answered with error_status instead.
+        error_status (int): HTTP status of injected errors.
+        run_failure_rate (float): Share of workflow runs answered with 200 that finish
+            with status "failed".
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chunks: int = 20,
+        chunk_interval: float = 0.0,
+        response_size: int = 1500,
+        upload_latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        run_failure_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.response_size = response_size
+        self.upload_latency = upload_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.run_failure_rate = run_failure_rate
+        self.rng = random.Random(seed)
+
+    def service_time(self, streaming: bool = True) -> float:
+        """Seconds the server spends on a workflow run, i.e. the part that isn't client overhead."""
+        return self.latency + (self.chunks * self.chunk_interval if streaming else 0)
+
+
+def _response_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def _split(text, parts):
+    """Split text into at most parts chunks of about the same size."""
+    size = max(1, -(-len(text) // max(parts, 1)))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class MockDifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send small writes (headers, SSE chunks) right away; Nagle's algorithm would hold
+    # them for the client's delayed ACK, adding ~40 ms to every call
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self) -> "MockDifyServer":
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_event(self, event: dict):
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0].rstrip("/")
+        config = self.mock.config
+        self.mock.count(path)
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._send_json(401, {"code": "unauthorized", "message": "Access token is missing."})
+        with self.mock.lock:
+            inject_error = config.rng.random() < config.error_rate
+        if inject_error:
+            self.mock.count("errors")
+            return self._send_json(config.error_status, {"code": "injected", "message": "Injected error."})
+
+        if path.endswith("/workflows/run"):
+            return self._run_workflow(json.loads(body))
+        if "/workflows/tasks/" in path and path.endswith("/stop"):
+            self.mock.stopped.add(path.split("/")[-2])
+            return self._send_json(200, {"result": "success"})
+        if path.endswith("/files/upload"):
+            time.sleep(config.upload_latency)
+            return self._send_json(201, {
+                "id": str(uuid.uuid4()),
+                "name": "upload.md",
+                "size": len(body),
+                "extension": "md",
+                "mime_type": "text/markdown",
+                "created_by": "mock",
+                "created_at": int(time.time()),
+            })
+        return self._send_json(404, {"code": "not_found", "message": f"No mock for {path}."})
+
+    def _run_workflow(self, data: dict):
+        config = self.mock.config
+        task_id = str(uuid.uuid4())
+        started = time.monotonic()
+        with self.mock.lock:
+            response = _response_text(config.rng, config.response_size)
+            fail_run = config.rng.random() < config.run_failure_rate
+        title = ""
+        if data.get("inputs", {}).get("new_chat") == "True":
+            title = f"Mock chat {task_id[:8]}"
+            response = ""
+
+        time.sleep(config.latency)
+
+        def finished(status, outputs):
+            return {
+                "id": task_id,
+                "workflow_id": "mock-workflow",
+                "status": status,
+                "outputs": outputs,
+                "error": "Injected run failure." if status == "failed" else None,
+                "elapsed_time": round(time.monotonic() - started, 3),
+                "total_tokens": len(response.split()),
+                "total_steps": 3,
+                "created_at": int(time.time()),
+                "finished_at": int(time.time()),
+            }
+
+        outputs = {"response": response, "new_chat_title": title}
+        if fail_run:
+            self.mock.count("failed_runs")
+            response = response[:len(response) // 2]
+        if data.get("response_mode") != "streaming":
+            if fail_run:
+                return self._send_json(200, {"task_id": task_id, "workflow_run_id": task_id, "data": finished("failed", {})})
+            return self._send_json(200, {"task_id": task_id, "workflow_run_id": task_id, "data": finished("succeeded", outputs)})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._send_event({"event": "workflow_started", "task_id": task_id, "workflow_run_id": task_id, "data": {"id": task_id}})
+            status = "failed" if fail_run else "succeeded"
+            if fail_run:
+                outputs = {}
+            for text in _split(response, config.chunks):
+                if task_id in self.mock.stopped:
+                    status, outputs = "stopped", {}
+                    break
+                self._send_event({"event": "text_chunk", "task_id": task_id, "workflow_run_id": task_id, "data": {"text": text}})
+                time.sleep(config.chunk_interval)
+            self._send_event({"event": "workflow_finished", "task_id": task_id, "workflow_run_id": task_id, "data": finished(status, outputs)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after stopping the run
+            self.close_connection = True
+
+
+class MockDifyServer:
+    """
+    The mock Dify API, served from a background thread:
+
+        with MockDifyServer(MockConfig(latency=0.2)) as server:
+            settings.DIFY_API_URL = server.url
+    """
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.stopped = set()
+        self._server = ThreadingHTTPServer((host, port), MockDifyHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, key: str):
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-dify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a mock Dify API for benchmarks and offline testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before a workflow run answers.")
+    parser.add_argument("--chunks", type=int, default=20, help="text_chunk events per streaming run.")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="Seconds between text_chunk events.")
+    parser.add_argument("--response-size", type=int, default=1500, help="Characters per response.")
+    parser.add_argument("--upload-latency", type=float, default=0.0, help="Seconds per upload.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with --error-status.")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--run-failure-rate", type=float, default=0.0, help="Share of runs finishing with status failed.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(
+        latency=args.latency,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        response_size=args.response_size,
+        upload_latency=args.upload_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        run_failure_rate=args.run_failure_rate,
+        seed=args.seed,
+    )
+    server = MockDifyServer(config, args.host, args.port)
+    print(f"Mock Dify API listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
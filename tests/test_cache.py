@@ -0,0 +1,52 @@
+import unittest
+from app.cache import RevisionCache
+
+
+class RevisionCacheTest(unittest.TestCase):
+    """Cached values are served until their scope is invalidated."""
+
+    def setUp(self):
+        self.cache = RevisionCache(max_entries=2)
+        self.loads = 0
+
+    def load(self, value):
+        def loader():
+            self.loads += 1
+            return value
+        return loader
+
+    def test_value_is_cached_until_its_scope_is_invalidated(self):
+        self.assertEqual(self.cache.get_or_load("a", "key", self.load(1)), 1)
+        self.assertEqual(self.cache.get_or_load("a", "key", self.load(2)), 1)
+        self.cache.invalidate("a")
+        self.assertEqual(self.cache.get_or_load("a", "key", self.load(3)), 3)
+        self.assertEqual(self.loads, 2)
+
+    def test_other_scopes_are_kept(self):
+        self.cache.get_or_load("a", "key", self.load(1))
+        self.cache.get_or_load("b", "key", self.load(2))
+        self.cache.invalidate("a")
+        self.assertEqual(self.cache.get_or_load("b", "key", self.load(3)), 2)
+        self.assertEqual(self.loads, 2)
+
+    def test_write_during_load_is_not_served_as_current(self):
+        def loader():
+            # A write lands after the value was read but before it was stored
+            self.cache.invalidate("a")
+            return "stale"
+
+        self.assertEqual(self.cache.get_or_load("a", "key", loader), "stale")
+        self.assertEqual(self.cache.get_or_load("a", "key", self.load("fresh")), "fresh")
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.get_or_load("a", 1, self.load(1))
+        self.cache.get_or_load("a", 2, self.load(2))
+        self.cache.get_or_load("a", 1, self.load(None))
+        self.cache.get_or_load("a", 3, self.load(3))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.get_or_load("a", 1, self.load(None)), 1)
+        self.assertEqual(self.cache.get_or_load("a", 2, self.load("reloaded")), "reloaded")
+
+
+if __name__ == "__main__":
+    unittest.main()
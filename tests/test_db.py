@@ -0,0 +1,81 @@
+import os
+import tempfile
+import threading
+import unittest
+from app.db import ConnectionManager, compress_content, inflate
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Connections outlive the threads (script runs) that checked them out."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "pool.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def checkout_in_thread(self, manager, work=None):
+        checked_out = []
+
+        def run():
+            conn = manager.get(self.db_path)
+            checked_out.append(conn)
+            if work is not None:
+                work(conn)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return checked_out[0]
+
+    def test_finished_thread_connection_is_reused(self):
+        manager = ConnectionManager()
+        first = self.checkout_in_thread(manager)
+        second = self.checkout_in_thread(manager)
+        self.assertIs(first, second)
+        # Still configured: the pragmas and SQL functions were applied once, when opened
+        self.assertEqual(second.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+        self.assertEqual(second.execute("SELECT inflate('raw', CAST('text' AS BLOB))").fetchone()[0], "text")
+        manager.close_all()
+
+    def test_open_transaction_is_rolled_back_before_reuse(self):
+        manager = ConnectionManager()
+
+        def die_in_transaction(conn):
+            conn.execute("CREATE TABLE IF NOT EXISTS t (x)")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO t VALUES (1)")
+
+        self.checkout_in_thread(manager, die_in_transaction)
+        conn = self.checkout_in_thread(manager)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+        manager.close_all()
+
+    def test_surplus_connections_are_closed(self):
+        manager = ConnectionManager(max_idle=0)
+        first = self.checkout_in_thread(manager)
+        second = self.checkout_in_thread(manager)
+        self.assertIsNot(first, second)
+        manager.close_all()
+
+
+class CompressionTest(unittest.TestCase):
+    """compress_content and inflate round-trip any text."""
+
+    def test_round_trip(self):
+        for text in ("", "short", "repeated text " * 500, "ünïcödé ✓ 漢字 " * 200):
+            encoding, data = compress_content(text)
+            self.assertEqual(inflate(encoding, data), text)
+
+    def test_incompressible_text_is_stored_raw(self):
+        self.assertEqual(compress_content("short"), ("raw", b"short"))
+        self.assertEqual(compress_content("a" * 4096)[0], "zlib")
+
+    def test_null_data_inflates_to_null(self):
+        self.assertIsNone(inflate("zlib", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
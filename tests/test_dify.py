@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+import app.dify as dify
+import app.dify_admission as dify_admission
+from app.dify_admission import AdmissionController, CircuitBreaker
+from app.dify_async import AsyncDifyClient
+from benchmarks.mock_dify import MockConfig, MockDifyServer
+
+
+def chat_input(query):
+    return {"Query": query, "new_chat": "False", "Knownledge_Base_Name": ""}
+
+
+class FailedRunBreakerTest(unittest.TestCase):
+    """Runs Dify answers with 200 but that fail count against the circuit breaker."""
+
+    def setUp(self):
+        self.server = MockDifyServer(MockConfig(run_failure_rate=1.0)).start()
+        self.settings = SimpleNamespace(DIFY_API_URL=self.server.url, DIFY_API_KEY="mock", RESPONSE_CACHE="False")
+        self.saved_admission = dify_admission._admission
+        self.admission = dify_admission._admission = AdmissionController(breaker=CircuitBreaker(min_calls=3, cooldown=60))
+
+    def tearDown(self):
+        dify_admission._admission = self.saved_admission
+        self.server.stop()
+
+    def test_failed_streamed_runs_open_the_breaker(self):
+        for n in range(3):
+            stream = dify.llm_chat_stream(chat_input(f"Question {n}"), self.settings, [])
+            "".join(stream)
+            self.assertTrue(stream._stream.failed)
+        # The admission slot is released by the stream's pump thread once it ended
+        for _ in range(100):
+            if self.admission.stats()["active"] == 0:
+                break
+            asyncio.run(asyncio.sleep(0.01))
+        self.assertEqual(self.admission.breaker.state, CircuitBreaker.OPEN)
+
+    def test_failed_async_runs_open_the_breaker(self):
+        async def run_all():
+            async with AsyncDifyClient(self.server.url, "mock") as client:
+                for n in range(3):
+                    run = await client.run_workflow({"inputs": chat_input(f"Question {n}"), "user": "test"})
+                    self.assertEqual(run["status"], "failed")
+
+        asyncio.run(run_all())
+        self.assertEqual(self.admission.breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import unittest
+from app.dify_admission import AdmissionController, CircuitBreaker, DifyUnavailable
+
+
+class CircuitBreakerProbeTest(unittest.TestCase):
+    """Only the probe admitted by a half-open breaker decides its state."""
+
+    def open_breaker(self):
+        breaker = CircuitBreaker(min_calls=2, cooldown=0)
+        breaker.record(False)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        return breaker
+
+    def test_straggler_does_not_decide(self):
+        breaker = self.open_breaker()
+        probe = breaker.check()
+        self.assertTrue(probe)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(DifyUnavailable):
+            breaker.check()
+
+        # A call admitted before the breaker opened finishes first
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record(False, probe)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_probe_success_closes(self):
+        breaker = self.open_breaker()
+        probe = breaker.check()
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record(True, probe)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_unsent_probe_lets_the_next_call_probe(self):
+        breaker = self.open_breaker()
+        breaker.record(None, breaker.check())
+        self.assertTrue(breaker.check())
+
+
+class AdmissionWaitTest(unittest.TestCase):
+    """A queued call reports its wait and can be interrupted meanwhile."""
+
+    def test_on_wait_while_queued(self):
+        admission = AdmissionController(max_concurrent=1, queue_timeout=5)
+        admission.acquire("a")
+        waits = []
+
+        def on_wait(waited):
+            waits.append(waited)
+            if len(waits) == 1:
+                threading.Thread(target=admission.release, args=(True,)).start()
+
+        self.assertFalse(admission.acquire("b", on_wait=on_wait))
+        self.assertEqual(len(waits), 1)
+        admission.release(True)
+        self.assertEqual(admission.stats()["active"], 0)
+
+    def test_interrupted_wait_withdraws(self):
+        admission = AdmissionController(max_concurrent=1, queue_timeout=5)
+        admission.acquire("a")
+
+        def on_wait(waited):
+            raise KeyboardInterrupt  # e.g. Streamlit stopping the script
+
+        with self.assertRaises(KeyboardInterrupt):
+            admission.acquire("b", on_wait=on_wait)
+        self.assertEqual(admission.stats()["queued"], 0)
+        admission.release(True)
+        self.assertEqual(admission.stats()["active"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import os
+import json
+import tempfile
+import threading
+import unittest
+from app.db import COMPRESSION_THRESHOLD, connection_manager, stop_vacuum_threads
+from app.history import ChatHistory, HISTORY_PAGE_SIZE, set_async_writes
+from app.truncate import MAX_CONTEXT_SIZE
+
+
+class ChatHistoryTestCase(unittest.TestCase):
+    """A ChatHistory on a fresh database file."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.history = ChatHistory(os.path.join(self.directory.name, "chat_history.db"))
+
+    def tearDown(self):
+        stop_vacuum_threads()
+        connection_manager.close_all()
+        self.directory.cleanup()
+
+    def add_turns(self, title, count, query="Question {n}", response="Answer {n}"):
+        self.history.create_chat_session(title)
+        for n in range(count):
+            user_input_id = self.history.add_user_input(title, json.dumps({"Query": query.format(n=n)}))
+            self.history.add_ai_response(title, user_input_id, response.format(n=n))
+
+
+class ChatContextTest(ChatHistoryTestCase):
+    """load_chat_history returns as many recent turns as fit the LLM context budget."""
+
+    def test_short_turns_beyond_a_page_are_kept(self):
+        self.add_turns("Short", HISTORY_PAGE_SIZE * 3)
+        messages = self.history.load_chat_history("Short")
+        self.assertEqual(len(messages), HISTORY_PAGE_SIZE * 3 * 2)
+        self.assertEqual(messages[0]["content"], "Question 0")
+        self.assertEqual(messages[-1]["content"], f"Answer {HISTORY_PAGE_SIZE * 3 - 1}")
+
+    def test_pages_stop_once_the_budget_is_filled(self):
+        turns = HISTORY_PAGE_SIZE * 3
+        self.add_turns("Long", turns, response="x" * (MAX_CONTEXT_SIZE // 10) + " {n}")
+        messages = self.history.load_chat_history("Long")
+        self.assertEqual(len(messages), HISTORY_PAGE_SIZE * 2)
+        self.assertEqual(messages[-1]["content"].split()[-1], str(turns - 1))
+
+
+
+class ArchiveTest(ChatHistoryTestCase):
+    """export_jsonl and import_jsonl round-trip the chat history."""
+
+    def setUp(self):
+        super().setUp()
+        self.archive = os.path.join(self.directory.name, "archive.jsonl")
+        self.other = ChatHistory(os.path.join(self.directory.name, "other.db"))
+
+    def test_round_trip_is_idempotent(self):
+        self.add_turns("First", 3, response="Answer {n} " + "long " * 1000)
+        self.add_turns("Second", 2)
+        user_input_id = self.history.fetch_conversation("Second")[0][0]
+        self.history.add_ai_response("Second", user_input_id, "Second version", version=2)
+        records = self.history.export_jsonl(self.archive)
+
+        counts = self.other.import_jsonl(self.archive, batch_size=4)
+        self.assertEqual(counts, {"sessions": 2, "user_inputs": 5, "ai_responses": 6, "skipped": 0})
+        for title in ("First", "Second"):
+            # Both databases number their rows in the same order, so even the IDs match
+            self.assertEqual(self.other.load_conversation(title), self.history.load_conversation(title))
+        self.assertEqual(self.other.get_ai_responses(user_input_id), self.history.get_ai_responses(user_input_id))
+
+        # Importing again skips every record of the existing sessions
+        counts = self.other.import_jsonl(self.archive, batch_size=4)
+        self.assertEqual(counts, {"sessions": 0, "user_inputs": 0, "ai_responses": 0, "skipped": records})
+        self.assertEqual(len(self.other.load_conversation("First")), 6)
+
+    def test_failed_batch_is_neither_written_nor_counted(self):
+        self.add_turns("First", 1)
+        self.add_turns("Second", 1)
+        self.history.export_jsonl(self.archive)
+        with open(self.archive, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"type": "unknown"}) + "\n")
+
+        # The first batch holds both sessions and the first turn; the second batch,
+        # with the second turn, fails on the unknown record
+        with self.assertLogs(level="ERROR") as logs:
+            with self.assertRaises(ValueError):
+                self.other.import_jsonl(self.archive, batch_size=4)
+        self.assertIn("{'sessions': 2, 'user_inputs': 1, 'ai_responses': 1, 'skipped': 0}", logs.output[0])
+        self.assertEqual(len(self.other.load_conversation("First")), 2)
+        self.assertEqual(self.other.load_conversation("Second"), [])
+
+
+class CachedReadTest(ChatHistoryTestCase):
+    """Reads served from history_cache see every committed write."""
+
+    def test_writes_invalidate_cached_reads(self):
+        self.add_turns("Chat", 1)
+        self.assertEqual(len(self.history.fetch_conversation("Chat")), 1)
+        self.assertEqual(self.history.fetch_chat_sessions()[0], "Chat")
+
+        user_input_id = self.history.add_user_input("Chat", json.dumps({"Query": "Another"}))
+        self.history.add_ai_response("Chat", user_input_id, "First version")
+        self.assertEqual(len(self.history.fetch_conversation("Chat")), 2)
+        self.assertEqual(self.history.get_ai_responses(user_input_id), [("First version", 1)])
+
+        self.history.update_ai_response(user_input_id, 1, "Edited")
+        self.assertEqual(self.history.get_ai_responses(user_input_id), [("Edited", 1)])
+        self.assertEqual(self.history.fetch_conversation("Chat")[-1][3], "Edited")
+
+        self.history.change_chat_name("Chat", "Renamed")
+        self.assertEqual(self.history.fetch_chat_sessions()[0], "Renamed")
+        self.assertEqual(self.history.fetch_conversation("Chat"), [])
+        self.assertEqual(len(self.history.fetch_conversation("Renamed")), 2)
+
+    def test_rolled_back_write_keeps_the_cached_read(self):
+        self.add_turns("Chat", 1)
+        before = self.history.fetch_conversation("Chat")
+        with self.assertRaises(RuntimeError):
+            with self.history.transaction():
+                self.history.add_user_input("Chat", json.dumps({"Query": "Discarded"}))
+                raise RuntimeError
+        self.assertEqual(self.history.fetch_conversation("Chat"), before)
+
+
+class SearchTest(ChatHistoryTestCase):
+    """search finds queries and responses by word and word prefix, best matches first."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_turns("Physics", 1, query="What is quantum entanglement?", response="Particles sharing one state.")
+        self.add_turns("Biology", 1, query="How do cells divide?", response="By mitosis; quantum effects are rare.")
+
+    def test_finds_queries_and_responses(self):
+        results = self.history.search("quantum")
+        self.assertEqual({(r["title"], r["role"]) for r in results}, {("Physics", "user"), ("Biology", "ai")})
+        self.assertIn("**quantum**", results[0]["snippet"])
+
+    def test_every_word_must_match_the_last_as_a_prefix(self):
+        self.assertEqual([r["title"] for r in self.history.search("quantum entang")], ["Physics"])
+        self.assertEqual([r["title"] for r in self.history.search("mito")], ["Biology"])
+        self.assertEqual(self.history.search("quantum mitochondria"), [])
+
+    def test_denser_match_ranks_first(self):
+        self.add_turns("Dense", 1, query="Tell me", response="Quantum quantum quantum.")
+        self.add_turns("Sparse", 1, query="Tell me", response="A long answer " + "about other things " * 20 + "and quantum.")
+        titles = [r["title"] for r in self.history.search("quantum") if r["role"] == "ai"]
+        self.assertLess(titles.index("Dense"), titles.index("Sparse"))
+
+    def test_operators_and_quotes_are_taken_literally(self):
+        for query in ('"quantum', "quantum*", "quantum:", "(quantum) -", "quantum) ^"):
+            self.assertEqual(len(self.history.search(query)), 2, query)
+        # As operators these would match every turn; as words they match none
+        self.assertEqual(self.history.search("quantum OR cells"), [])
+        self.assertEqual(self.history.search('"" * -'), [])
+
+    def test_limit(self):
+        self.add_turns("Many", 5, query="quantum {n}")
+        self.assertEqual(len(self.history.search("quantum", limit=3)), 3)
+
+
+class CompressedResponseTest(ChatHistoryTestCase):
+    """Large responses are stored compressed, once per distinct text."""
+
+    def count_blobs(self):
+        return self.history._connect().execute("SELECT COUNT(*) FROM content_blobs").fetchone()[0]
+
+    def test_identical_large_responses_share_one_blob(self):
+        large = "A long answer. " * COMPRESSION_THRESHOLD
+        self.add_turns("First", 2, response=large)
+        self.add_turns("Second", 1, response=large)
+        user_input_id = self.history.fetch_conversation("Second")[0][0]
+        self.history.add_ai_response("Second", user_input_id, large, version=2)
+        self.assertEqual(self.count_blobs(), 1)
+
+        self.assertEqual(self.history.get_ai_responses(user_input_id), [(large, 1), (large, 2)])
+        self.assertEqual([row[3] for row in self.history.fetch_conversation("First")], [large, large])
+        stored = self.history._connect().execute("SELECT DISTINCT content FROM chat_messages").fetchall()
+        self.assertEqual(stored, [("",)])
+
+    def test_small_and_distinct_responses(self):
+        self.add_turns("Chat", 2, response="Answer {n} " + "x" * COMPRESSION_THRESHOLD)
+        self.add_turns("Small", 1)
+        self.assertEqual(self.count_blobs(), 2)
+        self.assertEqual(self.history.fetch_conversation("Small")[0][3], "Answer 0")
+
+    def test_edited_response_is_stored_again(self):
+        self.add_turns("Chat", 1, response="x" * COMPRESSION_THRESHOLD)
+        user_input_id = self.history.fetch_conversation("Chat")[0][0]
+        self.history.update_ai_response(user_input_id, 1, "y" * COMPRESSION_THRESHOLD)
+        self.assertEqual(self.history.get_ai_responses(user_input_id), [("y" * COMPRESSION_THRESHOLD, 1)])
+
+
+class BackgroundWriteTest(ChatHistoryTestCase):
+    """With background writes on, a session reads its own writes."""
+
+    def setUp(self):
+        super().setUp()
+        set_async_writes(True, self.history.db_path)
+
+    def tearDown(self):
+        set_async_writes(False, self.history.db_path)
+        super().tearDown()
+
+    def test_reads_wait_for_queued_writes(self):
+        self.add_turns("Chat", 1)
+        user_input_id = self.history.fetch_conversation("Chat")[0][0]
+
+        release = threading.Event()
+        self.history.run_write(release.wait)
+        self.history.update_ai_response(user_input_id, 1, "Edited")
+        threading.Timer(0.1, release.set).start()
+        self.assertEqual(self.history.get_ai_responses(user_input_id), [("Edited", 1)])
+        self.assertEqual(self.history.fetch_conversation("Chat")[0][3], "Edited")
+
+    def test_waiting_writes_return_their_result(self):
+        self.history.create_chat_session("Chat")
+        user_input_id = self.history.add_user_input("Chat", json.dumps({"Query": "Question"}))
+        self.assertIsNotNone(user_input_id)
+        self.history.change_chat_name("Chat", "Renamed")
+        self.assertEqual(self.history.fetch_chat_sessions(), ["Renamed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from app.db import get_connection, connection_manager
+import app.migrations as migrations
+
+
+class LegacyDatabaseUpgradeTest(unittest.TestCase):
+    """Upgrading a version 0 database, created before foreign keys were enforced."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "chat_history.db")
+
+        # The original schema, with rows left behind by session deletions that
+        # didn't cascade: an input and responses of a deleted session, and a
+        # response of a deleted input
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE chat_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT UNIQUE NOT NULL,
+                file_name TEXT,
+                file_id TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE user_inputs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                FOREIGN KEY (session_id) REFERENCES chat_sessions (id)
+            );
+            CREATE TABLE chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                user_input_id INTEGER,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                edited_code TEXT,
+                FOREIGN KEY (session_id) REFERENCES chat_sessions (id),
+                FOREIGN KEY (user_input_id) REFERENCES user_inputs (id)
+            );
+            INSERT INTO chat_sessions (id, title) VALUES (1, 'Kept chat');
+            INSERT INTO user_inputs (id, session_id, content) VALUES (1, 1, '{"Query": "kept question"}');
+            INSERT INTO chat_messages (id, session_id, user_input_id, role, content) VALUES (1, 1, 1, 'ai', 'kept answer');
+            INSERT INTO user_inputs (id, session_id, content) VALUES (2, 2, '{"Query": "orphan question"}');
+            INSERT INTO chat_messages (id, session_id, user_input_id, role, content) VALUES (2, 2, 2, 'ai', 'orphan answer');
+            INSERT INTO chat_messages (id, session_id, user_input_id, role, content) VALUES (3, 1, 3, 'ai', 'answer of a deleted input');
+        """)
+        conn.close()
+
+    def tearDown(self):
+        connection_manager.close_all()
+        self.directory.cleanup()
+
+    def test_upgrade_deletes_orphans(self):
+        conn = get_connection(self.db_path)
+        migrations.migrate(conn)
+
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], migrations.SCHEMA_VERSION)
+        self.assertEqual(conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+        self.assertEqual(conn.execute("SELECT id FROM user_inputs").fetchall(), [(1,)])
+        self.assertEqual(conn.execute("SELECT id, content FROM chat_messages_text").fetchall(), [(1, "kept answer")])
+
+        # Deleting the session now cascades to its inputs and responses
+        conn.execute("DELETE FROM chat_sessions WHERE id = 1")
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM user_inputs").fetchone()[0], 0)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
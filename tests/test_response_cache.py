@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app.db import connection_manager
+from app.response_cache import ResponseCache, request_key
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Cached outputs expire after the TTL; the least recently used are evicted."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        clock = mock.patch("app.response_cache.time.time", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.cache = ResponseCache(os.path.join(self.directory.name, "cache.db"), ttl=60, max_entries=2)
+
+    def tearDown(self):
+        connection_manager.close_all()
+        self.directory.cleanup()
+
+    def test_outputs_expire_after_the_ttl(self):
+        self.cache.put("key", {"answer": "cached"})
+        self.now += 59
+        self.assertEqual(self.cache.get("key"), {"answer": "cached"})
+        self.now += 1
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+        # Expired entries are dropped by the next put
+        self.cache.put("other", {})
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("first", {"n": 1})
+        self.now += 1
+        self.cache.put("second", {"n": 2})
+        self.now += 1
+        self.cache.get("first")
+        self.now += 1
+        self.cache.put("third", {"n": 3})
+
+        self.assertIsNone(self.cache.get("second"))
+        self.assertEqual(self.cache.get("first"), {"n": 1})
+        self.assertEqual(self.cache.get("third"), {"n": 3})
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_put_replaces_outputs(self):
+        self.cache.put("key", {"n": 1})
+        self.cache.put("key", {"n": 2})
+        self.assertEqual(self.cache.get("key"), {"n": 2})
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+
+class RequestKeyTest(unittest.TestCase):
+    """request_key identifies a run by its inputs and workflow only."""
+
+    def test_key(self):
+        data = {"inputs": {"Query": "Hi", "History": "[]"}, "response_mode": "blocking", "user": "a"}
+        key = request_key(data, "http://dify/v1", "key")
+        same = {"inputs": {"History": "[]", "Query": "Hi"}, "response_mode": "streaming", "user": "b"}
+        self.assertEqual(request_key(same, "http://dify/v1/", "key"), key)
+        self.assertNotEqual(request_key(data, "http://dify/v1", "other key"), key)
+        self.assertNotEqual(request_key({"inputs": {"Query": "Hello"}}, "http://dify/v1", "key"), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import unittest
+from app.singleflight import SingleFlight
+
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's StopException/RerunException."""
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Joiners of a flight get the leader's result or error."""
+
+    def run_joined(self, flight, key, leader_call, joiners=3):
+        """Run leader_call as leader of key while joiners call with the same key; return their outcomes."""
+        started = threading.Event()
+        release = threading.Event()
+        outcomes = []
+        lock = threading.Lock()
+
+        def lead():
+            started.set()
+            release.wait(5)
+            return leader_call()
+
+        def join():
+            try:
+                outcome = flight.do(key, lambda: "joiner ran the call")
+            except Exception as e:
+                outcome = e
+            with lock:
+                outcomes.append(outcome)
+
+        def leader():
+            try:
+                flight.do(key, lead)
+            except BaseException:
+                pass
+
+        leader_thread = threading.Thread(target=leader)
+        leader_thread.start()
+        started.wait(5)
+        threads = [threading.Thread(target=join) for _ in range(joiners)]
+        for thread in threads:
+            thread.start()
+        while flight.shared < joiners:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in [leader_thread, *threads]:
+            thread.join(5)
+        return outcomes
+
+    def test_joiners_get_the_leaders_result(self):
+        flight = SingleFlight()
+        outcomes = self.run_joined(flight, "key", lambda: "answer")
+        self.assertEqual(outcomes, [("answer", True)] * 3)
+        self.assertEqual(flight.calls, 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_joiners_get_the_leaders_error(self):
+        flight = SingleFlight()
+        error = ValueError("Dify failed")
+
+        def fail():
+            raise error
+
+        outcomes = self.run_joined(flight, "key", fail)
+        self.assertEqual(outcomes, [error] * 3)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_interrupted_leader_is_not_shared(self):
+        flight = SingleFlight()
+
+        def interrupted():
+            raise Interrupted()
+
+        outcomes = self.run_joined(flight, "key", interrupted)
+        # The joiners don't see the interruption: one of them took over as leader
+        self.assertEqual([result for result, _ in outcomes], ["joiner ran the call"] * 3)
+        self.assertIn(("joiner ran the call", False), outcomes)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_hold_keeps_the_flight_until_released(self):
+        flight = SingleFlight()
+        flight.do("key", lambda: "stream", hold=True)
+        self.assertEqual(flight.do("key", lambda: "other"), ("stream", True))
+        flight.release("key")
+        self.assertEqual(flight.do("key", lambda: "other"), ("other", False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import threading
+import unittest
+from app.db import connection_manager, get_connection
+from app.writer import BackgroundWriter
+
+
+class BackgroundWriterTest(unittest.TestCase):
+    """Queued writes are committed in order, each failing on its own."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "writer.db")
+        get_connection(self.db_path).execute("CREATE TABLE t (x INTEGER UNIQUE)")
+        self.writer = BackgroundWriter(self.db_path)
+
+    def tearDown(self):
+        self.writer.stop()
+        connection_manager.close_all()
+        self.directory.cleanup()
+
+    def insert(self, x):
+        def write():
+            get_connection(self.db_path).execute("INSERT INTO t VALUES (?)", (x,))
+            return x
+        return write
+
+    def rows(self):
+        return [row[0] for row in get_connection(self.db_path).execute("SELECT x FROM t ORDER BY rowid")]
+
+    def test_writes_are_applied_in_order(self):
+        futures = [self.writer.submit("session", self.insert(x)) for x in range(100)]
+        self.assertEqual([future.result() for future in futures], list(range(100)))
+        self.assertEqual(self.rows(), list(range(100)))
+
+    def test_failing_write_is_rolled_back_alone(self):
+        first = self.writer.submit("session", self.insert(1))
+        with self.assertLogs(level="ERROR"):
+            duplicate = self.writer.submit("session", self.insert(1))
+            last = self.writer.submit("session", self.insert(2))
+            self.writer.flush()
+        self.assertEqual(first.result(), 1)
+        self.assertEqual(last.result(), 2)
+        self.assertIsNotNone(duplicate.exception())
+        self.assertEqual(self.rows(), [1, 2])
+
+    def test_wait_for_blocks_until_the_session_writes_committed(self):
+        release = threading.Event()
+
+        def slow_write():
+            release.wait()
+            return self.insert(1)()
+
+        self.writer.submit("session", slow_write)
+        # Other sessions don't wait for it
+        self.writer.wait_for("other", timeout=0)
+        threading.Timer(0.1, release.set).start()
+        self.writer.wait_for("session", timeout=5)
+        self.assertEqual(self.rows(), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()